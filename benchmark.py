@@ -0,0 +1,256 @@
+'''Reproducible performance benchmark, on synthetic pages of digits.
+Measures per stage and end to end throughput and peak memory (each
+workload runs on a new process), and stores the results as json, to be compared with a previous run. Also
+measures the import time of the inference modules, against a budget,
+and checks optimized code against its reference implementation:
+
+    python benchmark.py --output new.json --baseline old.json
+'''
+
+from processor import enable_profiling, disable_profiling
+from segmentation import ContourSegmenter
+from feature_extraction import SimpleFeatureExtractor
+from classification import NumpyKNNClassifier, classes_to_numpy
+from segmentation_aux import contained_segments, contained_segments_matrix
+from opencv_utils import background_color
+from timeit import default_timer
+import subprocess
+import resource
+import numpy
+import json
+import sys
+import os
+import cv2
+
+WORKLOADS= {
+    "small":  {"lines":5,  "glyphs_per_line":30,  "font_scale":1.0, "noise":0.0},
+    "medium": {"lines":20, "glyphs_per_line":60,  "font_scale":1.0, "noise":0.05},
+    "dense":  {"lines":40, "glyphs_per_line":100, "font_scale":0.8, "noise":0.05},
+    }
+
+def synthetic_page( lines, glyphs_per_line, font_scale=1.0, noise=0.0, seed=0 ):
+    '''renders a page of random digits with cv2.putText. Returns the
+    (BGR) image, and the ground segments and classes of the digits'''
+    random= numpy.random.RandomState( seed )
+    cell_w, cell_h= int(24*font_scale), int(48*font_scale)
+    margin= cell_h
+    image= numpy.empty( (2*margin+lines*cell_h, 2*margin+glyphs_per_line*cell_w, 3), dtype=numpy.uint8 )
+    image.fill( 255 )
+    chars= random.randint( 0, 10, (lines, glyphs_per_line) ).astype(str)
+    segments= []
+    for l in range(lines):
+        for g in range(glyphs_per_line):
+            x, y= margin+g*cell_w, margin+l*cell_h
+            baseline= y+int(cell_h*0.75)
+            cv2.putText( image, chars[l,g], (x, baseline), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0,0,0), 2 )
+            ys, xs= numpy.nonzero( image[y:y+cell_h, x:x+cell_w, 0] < 128 )
+            segments.append( (x+xs.min(), y+ys.min(), xs.max()-xs.min()+1, ys.max()-ys.min()+1) )
+    if noise:
+        noisy= image + random.normal( 0, noise*255, image.shape )
+        image= numpy.clip( noisy, 0, 255 ).astype( numpy.uint8 )
+    segments= numpy.array( segments, dtype=numpy.uint16 )
+    classes= classes_to_numpy( list(chars.ravel()) )
+    return image, segments, classes
+
+IMPORT_TIME_MODULES= ["inference", "ocr", "segmentation", "feature_extraction", "classification"]
+IMPORT_TIME_BUDGET= 0.25 #seconds, for importing ocr (what inference needs before loading a model)
+
+def measure_import_time( module, repeat=5 ):
+    '''the best time to import module (and everything it imports) on
+    a new python process, in seconds'''
+    code= "from timeit import default_timer; t=default_timer(); import {0}; print default_timer()-t".format( module )
+    return min( float( subprocess.check_output( [sys.executable, "-c", code] ) ) for _ in range(repeat) )
+
+BACKGROUND_SHAPES= {"page":(2000,1500,3), "wide_scan":(3000,8000,3)}
+
+def time_background_color( shapes=BACKGROUND_SHAPES, repeat=3 ):
+    '''best times of background_color on random uint8 images of the
+    given shapes (by name), and of the plain numpy medians it replaces
+    (as "<name>.numpy_median")'''
+    random= numpy.random.RandomState( 0 )
+    times= {}
+    for name, shape in sorted(shapes.items()):
+        image= random.randint( 0, 256, shape ).astype( numpy.uint8 )
+        for key, function in ((name, background_color), (name+".numpy_median", lambda i: numpy.median(numpy.median(i,0),0))):
+            best= float("inf")
+            for _ in range(repeat):
+                start= default_timer()
+                function( image )
+                best= min( best, default_timer()-start )
+            times[key]= best
+    return times
+
+def check_contained_segments( cases=200, seed=0 ):
+    '''checks contained_segments against contained_segments_matrix, on
+    random segments (with small coordinates, so there are many ties and
+    duplicates) and on the segments of a synthetic page. Raises on the
+    first difference; returns the number of cases checked'''
+    random= numpy.random.RandomState( seed )
+    segment_sets= [synthetic_page( **WORKLOADS["small"] )[1]]
+    for _ in range(cases):
+        n= random.randint( 1, 60 )
+        xy= random.randint( 0, 8, (n,2) )
+        wh= random.randint( 0, 6, (n,2) )
+        segment_sets.append( numpy.hstack( (xy, wh) ) )
+    segment_sets.append( numpy.array( [(1,1,2,2)]*5+[(0,0,4,4)]*3 ) ) #exact duplicates, containing each other
+    for segments in segment_sets:
+        expected= numpy.max( contained_segments_matrix( segments ), axis=1 )
+        if not numpy.array_equal( contained_segments( segments ), expected ):
+            raise Exception("contained_segments differs from contained_segments_matrix on: "+repr(segments.tolist()))
+    return len(segment_sets)
+
+def _memory_status( field ):
+    '''a field of /proc/self/status, in bytes (linux), or None'''
+    try:
+        with open( "/proc/self/status" ) as f:
+            for line in f:
+                if line.startswith( field+":" ):
+                    return int( line.split()[1] )*1024
+    except IOError:
+        pass
+    return None
+
+def _peak_memory():
+    '''peak resident memory of this process (since the last 
+    _reset_peak_memory, where supported), in bytes'''
+    peak= _memory_status( "VmHWM" )
+    return peak if peak is not None else resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss*1024
+
+def _reset_peak_memory():
+    '''resets the peak to the current resident memory, and returns it.
+    Returns None if that's not supported (only linux does)'''
+    try:
+        with open( "/proc/self/clear_refs", 'w' ) as f:
+            f.write( "5" )
+    except IOError:
+        return None
+    return _memory_status( "VmRSS" )
+
+def run_workload( lines, glyphs_per_line, font_scale=1.0, noise=0.0, repeat=3, segmenter_parameters={} ):
+    '''trains on one synthetic page and ocrs another, repeat times.
+    Returns the best time of each stage (processors of the segmenter,
+    feature extraction, classification and the whole ocr) and
+    throughputs. Memory is the peak of the process, and the most
+    each stage grew it by, in bytes (per stage only on linux)'''
+    page= dict( lines=lines, glyphs_per_line=glyphs_per_line, font_scale=font_scale, noise=noise )
+    train_image, train_segments, train_classes= synthetic_page( seed=1, **page )
+    image, segments, classes= synthetic_page( seed=2, **page )
+    segmenter= ContourSegmenter( **segmenter_parameters )
+    extractor= SimpleFeatureExtractor()
+    classifier= NumpyKNNClassifier()
+    classifier.train( extractor.extract(train_image, train_segments), train_classes )
+    times, memory= {}, {}
+    def record( name, seconds ):
+        times[name]= min( times.get(name, float("inf")), seconds )
+    def stage( name, function, *args ):
+        start_memory= _reset_peak_memory()
+        result= function( *args )
+        if start_memory is not None:
+            memory[name]= max( memory.get(name, 0), _peak_memory()-start_memory )
+        return result
+    for _ in range(repeat):
+        image= image.copy() #don't reuse per image caches
+        profiler= enable_profiling()
+        start= default_timer()
+        try:
+            found_segments= stage( "segmentation", segmenter.process, image )
+        finally:
+            disable_profiling()
+        segmented= default_timer()
+        features= stage( "feature_extraction", extractor.extract, image, found_segments )
+        extracted= default_timer()
+        stage( "classification", classifier.classify, features )
+        classified= default_timer()
+        for name, stats in profiler.to_dict().items():
+            record( "segmentation."+name, stats["time"] )
+        record( "feature_extraction", extracted-segmented )
+        record( "classification", classified-extracted )
+        record( "end_to_end", classified-start )
+    return {
+        "page":             page,
+        "glyphs":           len(segments),
+        "segments_found":   len(found_segments),
+        "times":            times,
+        "pages_per_second": 1/times["end_to_end"],
+        "glyphs_per_second": len(segments)/times["end_to_end"],
+        "memory":           dict( memory, peak=_peak_memory() ),
+        }
+
+def _run_workload_process( arguments ):
+    '''run_workload on a new python process, so its peak memory is
+    its own'''
+    code= "import benchmark, json, sys; print json.dumps( benchmark.run_workload( **json.loads(sys.argv[1]) ) )"
+    output= subprocess.check_output( [sys.executable, "-c", code, json.dumps(arguments)], cwd=os.path.dirname(os.path.abspath(__file__)) )
+    return json.loads( output )
+
+def run_benchmark( workloads=WORKLOADS, repeat=3, segmenter_parameters={}, isolate=True ):
+    '''runs all the workloads - each on a new process, if isolate;
+    returns their results, by name'''
+    run= _run_workload_process if isolate else lambda arguments: run_workload( **arguments )
+    return dict( (name, run( dict(w, repeat=repeat, segmenter_parameters=segmenter_parameters) )) for name,w in sorted(workloads.items()) )
+
+def compare( results, baseline, tolerance=0.2, min_seconds=0.001, min_bytes=2**20 ):
+    '''returns a list of (workload, stage, baseline, new) for the 
+    stages that got slower or used more memory than baseline by more
+    than tolerance (relative) and min_seconds or min_bytes (absolute,
+    to ignore noise). Memory stages are named "memory.<stage>"'''
+    regressions= []
+    for name, result in sorted(results.items()):
+        old_result= baseline.get( name, {} )
+        measures= [("", result["times"], old_result.get("times", {}), min_seconds)]
+        if "memory" in result:
+            measures.append( ("memory.", result["memory"], old_result.get("memory", {}), min_bytes) )
+        for prefix, new_values, old_values, minimum in measures:
+            for stage, new in sorted(new_values.items()):
+                old= old_values.get( stage )
+                if old is not None and new > old*(1+tolerance) and new-old > minimum:
+                    regressions.append( (name, prefix+stage, old, new) )
+    return regressions
+
+if __name__=="__main__":
+    import argparse
+    parser= argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( "--output", help="json file to write the results to" )
+    parser.add_argument( "--baseline", help="json results of a previous run, to compare with" )
+    parser.add_argument( "--tolerance", type=float, default=0.2, help="relative slowdown reported as regression" )
+    parser.add_argument( "--repeat", type=int, default=3 )
+    parser.add_argument( "--workloads", nargs="+", choices=sorted(WORKLOADS), default=sorted(WORKLOADS) )
+    parser.add_argument( "--import-budget", type=float, default=IMPORT_TIME_BUDGET, help="seconds allowed to import ocr" )
+    args= parser.parse_args()
+    print "checked contained_segments on", check_contained_segments(), "cases"
+    results= run_benchmark( dict((w, WORKLOADS[w]) for w in args.workloads), repeat=args.repeat )
+    import_times= dict( (m, measure_import_time(m, args.repeat)) for m in IMPORT_TIME_MODULES )
+    background_times= time_background_color( repeat=args.repeat )
+    for name, result in sorted(results.items()):
+        print name, "({0} glyphs): {1:.2f} pages/s, peak memory {2:.1f} MB".format( result["glyphs"], result["pages_per_second"], result["memory"]["peak"]/2.0**20 )
+        for stage, t in sorted(result["times"].items(), key=lambda x: -x[1]):
+            print "    {0:<40} {1:.4f}s".format( stage, t )
+        for stage, m in sorted(result["memory"].items()):
+            if stage!="peak":
+                print "    {0:<40} +{1:.1f} MB".format( "memory."+stage, m/2.0**20 )
+    print "import times (budget for ocr: {0:.3f}s)".format( args.import_budget )
+    for module, t in sorted(import_times.items(), key=lambda x: -x[1]):
+        print "    {0:<40} {1:.4f}s".format( module, t )
+    results["import"]= {"times": import_times} #compared with the baseline like the workloads
+    print "background_color"
+    for name, t in sorted(background_times.items()):
+        print "    {0:<40} {1:.4f}s".format( name, t )
+    results["background_color"]= {"times": background_times}
+    over_budget= import_times["ocr"] > args.import_budget
+    if over_budget:
+        print "OVER BUDGET", "import ocr", "{0:.4f}s > {1:.4f}s".format( import_times["ocr"], args.import_budget )
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            json.dump( results, f, indent=1, sort_keys=True )
+    if args.baseline:
+        with open( args.baseline ) as f:
+            regressions= compare( results, json.load(f), args.tolerance )
+        for name, stage, old, new in regressions:
+            if stage.startswith( "memory." ):
+                print "REGRESSION", name, stage, "{0:.1f} MB -> {1:.1f} MB".format( old/2.0**20, new/2.0**20 )
+            else:
+                print "REGRESSION", name, stage, "{0:.4f}s -> {1:.4f}s".format( old, new )
+        if regressions:
+            raise SystemExit( 1 )
+    if over_budget:
+        raise SystemExit( 1 )
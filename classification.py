@@ -1,4 +1,5 @@
 from feature_extraction import FEATURE_DATATYPE
+from nearest_neighbors import INDEXES, NearestNeighborsIndex, majority_vote
 import numpy
 import cv2
 
@@ -9,13 +10,10 @@ CLASSES_DIRECTION=  0 #vertical - a classes COLUMN
 BLANK_CLASS=        chr(35) #marks unclassified elements
 
 def classes_to_numpy( classes ):
-    '''given a list of unicode chars, transforms it into a numpy array'''
-    import array
-    #utf-32 starts with constant ''\xff\xfe\x00\x00', then has little endian 32 bits chars
-    #this assumes little endian architecture!
-    assert unichr(15).encode('utf-32')=='\xff\xfe\x00\x00\x0f\x00\x00\x00'
-    assert array.array("I").itemsize==4
-    int_classes= array.array( "I", "".join(classes).encode('utf-32')[4:])
+    '''given a list of unicode chars (or a unicode string), transforms 
+    it into a numpy array'''
+    #utf-32-le has no BOM; each char is a little endian 32 bits integer
+    int_classes= numpy.frombuffer( u"".join(classes).encode('utf-32-le'), dtype='<u4' )
     assert len(int_classes) == len(classes)
     classes=  numpy.array( int_classes,  dtype=CLASS_DATATYPE, ndmin=2) #each class in a column. numpy is strange :(
     classes= classes if CLASSES_DIRECTION==1 else numpy.transpose(classes)
@@ -28,6 +26,8 @@ def classes_from_numpy(classes):
     return classes
 
 class Classifier( object ):
+    '''after training, a classifier has the (classified) training 
+    feature vectors and classes as the features and classes attributes'''
     def train( self, features, classes ):
         '''trains the classifier with the classified feature vectors'''
         raise NotImplementedError()
@@ -35,12 +35,18 @@ class Classifier( object ):
     @staticmethod
     def _filter_unclassified( features, classes ):
         classified= (classes != classes_to_numpy(BLANK_CLASS)).reshape(-1)
+        if numpy.all(classified):
+            return features, classes #don't copy (features may be memory mapped)
         return features[classified], classes[classified]
         
     def classify( self, features):
         '''returns the classes of the feature vectors'''
         raise NotImplementedError
 
+    def get_settings( self ):
+        '''returns the constructor arguments of this classifier'''
+        raise NotImplementedError()
+
 class KNNClassifier( Classifier ):
     def __init__(self, k=1, debug=False):
         self.knn= cv2.KNearest()
@@ -54,9 +60,59 @@ class KNNClassifier( Classifier ):
             classes= numpy.asarray( classes, dtype=numpy.float32 )
         features, classes= Classifier._filter_unclassified( features, classes )
         self.knn.train( features, classes )
+        self.features, self.classes= features, classes
+
+    def get_settings( self ):
+        return {"k":self.k, "debug":self.debug}
+
+    def __getstate__( self ):
+        '''cv2.KNearest can't be pickled - the training data is, instead'''
+        state= self.__dict__.copy()
+        del state["knn"]
+        return state
+
+    def __setstate__( self, state ):
+        self.__dict__.update( state )
+        self.knn= cv2.KNearest()
+        if hasattr(self, "features"):
+            self.knn.train( self.features, self.classes )
         
     def classify( self, features):
         if FEATURE_DATATYPE!=numpy.float32:
             features= numpy.asarray( features, dtype=numpy.float32 )
-        retval, result_classes, neigh_resp, dists= self.knn.find_nearest(features, k= 1)
+        retval, result_classes, neigh_resp, dists= self.knn.find_nearest(features, k= self.k)
+        return result_classes
+
+class NumpyKNNClassifier( Classifier ):
+    '''k nearest neighbours, with majority voting, on numpy alone.
+    index is either a NearestNeighborsIndex instance or one of 
+    nearest_neighbors.INDEXES ("brute", "kdtree"), constructed with
+    index_settings'''
+    def __init__(self, k=1, index="brute", index_settings={}):
+        self.k=k
+        self.index= index if isinstance(index, NearestNeighborsIndex) else INDEXES[index]( **index_settings )
+
+    def get_settings( self ):
+        index_names= [name for name,cls in INDEXES.items() if type(self.index)==cls]
+        if not index_names:
+            raise Exception("can't describe index {0}: only nearest_neighbors.INDEXES are supported".format( self.index.__class__.__name__ ))
+        return {"k":self.k, "index":index_names[0], "index_settings":self.index.get_settings()}
+
+    def train( self, features, classes ):
+        features= numpy.ascontiguousarray( features, dtype=numpy.float32 )
+        features, classes= Classifier._filter_unclassified( features, classes )
+        self.features, self.classes= features, classes.reshape(-1)
+        self.index.build( features )
+
+    def classify( self, features, return_distances=False):
+        '''returns the classes of the feature vectors, as a float32 
+        column (like KNNClassifier). If return_distances, returns 
+        (classes, distances), distances being the squared distances to
+        the k nearest neighbours'''
+        features= numpy.ascontiguousarray( features, dtype=numpy.float32 )
+        distances, indexes= self.index.query( features, self.k )
+        result_classes= majority_vote( self.classes[indexes] )
+        result_classes= result_classes.astype( numpy.float32 ).reshape(-1,1)
+        if return_distances:
+            return result_classes, distances
         return result_classes
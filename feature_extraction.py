@@ -1,7 +1,8 @@
 import numpy
 import cv2
 from segmentation import region_from_segment
-from opencv_utils import background_color
+from image_context import image_context
+from segment_table import SegmentTable
 
 FEATURE_DATATYPE=   numpy.float32
 #FEATURE_SIZE is defined on the specific feature extractor instance
@@ -13,33 +14,46 @@ class FeatureExtractor( object ):
     def extract( self, image, segments ):
         raise NotImplementedError()
 
+    def get_settings( self ):
+        '''returns the constructor arguments of this extractor'''
+        raise NotImplementedError()
+
 class SimpleFeatureExtractor( FeatureExtractor ):
     def __init__(self, feature_size=10, stretch=False):
         self.feature_size= feature_size
         self.stretch=stretch
 
-    def extract(self, image, segments):
-        image= cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+    def get_settings( self ):
+        return {"feature_size":self.feature_size, "stretch":self.stretch}
+
+    def extract(self, image, segments, out=None):
+        '''out, if given, is a FEATURE_DATATYPE buffer with at least 
+        len(segments) rows of feature_size**2; it's filled and (the 
+        first len(segments) rows) returned, so that callers can reuse 
+        memory across images'''
+        context= image_context( image )
+        image= context.gray
         fs= self.feature_size
-        bg= background_color( image )
- 
-        regions=numpy.ndarray( shape=(0,fs), dtype=FEATURE_DATATYPE )
-        for segment in segments:
-            region= region_from_segment( image, segment )
+        n= len(segments)
+        if out is None:
+            out= numpy.empty( (n, fs**2), dtype=FEATURE_DATATYPE )
+        if out.dtype!=FEATURE_DATATYPE or out.ndim!=2 or out.shape[0]<n or out.shape[1]!=fs**2 or not out.flags.c_contiguous:
+            raise Exception("output buffer must be a contiguous {0} array of shape (>={1},{2})".format(numpy.dtype(FEATURE_DATATYPE), n, fs**2))
+        out= out[:n]
+        regions= out.reshape( (n, fs, fs) ) #a view on out - one fs*fs matrix per segment
+        if not self.stretch:
+            regions.fill( context.background )
+        for region, segment in zip(regions, SegmentTable.wrap(segments)): #python ints are faster to unpack
+            subimage= region_from_segment( image, segment )
             if self.stretch:
-                region = cv2.resize(region, (fs,fs) )
+                region[:,:]= cv2.resize(subimage, (fs,fs) )
             else:
                 x,y,w,h= segment
                 proportion= float(min(h,w))/max(w,h)
                 new_size= (fs, int(fs*proportion)) if min(w,h)==h else (int(fs*proportion), fs)
-                region = cv2.resize(region, new_size)
-                s= region.shape
-                newregion= numpy.ndarray( (fs,fs), dtype= region.dtype )
-                newregion[:,:]= bg
-                newregion[:s[0],:s[1]]= region
-                region=newregion
-            regions= numpy.append( regions, region, axis=0 )
-        regions.shape=( len(segments), fs**2 )
-        return regions
+                subimage= cv2.resize(subimage, new_size)
+                s= subimage.shape
+                region[:s[0],:s[1]]= subimage
+        return out
 
 
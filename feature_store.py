@@ -0,0 +1,85 @@
+from feature_extraction import FEATURE_DATATYPE
+from classification import CLASS_DATATYPE
+import numpy
+import json
+import os
+
+class FeatureStore( object ):
+    '''an append-only store of classified feature vectors, used for
+    incremental training'''
+    def append( self, features, classes ):
+        '''adds a n*d array of features and their n*1 classes'''
+        raise NotImplementedError()
+
+    def arrays( self ):
+        '''returns (features, classes), with everything appended so far'''
+        raise NotImplementedError()
+
+    def __len__( self ):
+        raise NotImplementedError()
+
+class MemoryFeatureStore( FeatureStore ):
+    '''keeps the appended arrays in memory, as chunks. They're only
+    concatenated when arrays() is called'''
+    def __init__( self ):
+        self._features, self._classes= [], []
+
+    def append( self, features, classes ):
+        self._features.append( numpy.array( features, dtype=FEATURE_DATATYPE ) )
+        self._classes.append( numpy.array( classes, dtype=CLASS_DATATYPE ).reshape(-1,1) )
+
+    def arrays( self ):
+        if not self._features:
+            raise Exception("empty feature store")
+        if len(self._features)>1: #consolidate
+            self._features= [numpy.concatenate( self._features )]
+            self._classes=  [numpy.concatenate( self._classes )]
+        return self._features[0], self._classes[0]
+
+    def __len__( self ):
+        return sum( map(len, self._features) )
+
+class DiskFeatureStore( FeatureStore ):
+    '''appends to raw binary files on the directory path; arrays()
+    memory maps them, so memory usage doesn't grow with the store.
+    An existing store directory is reopened, and appended to'''
+    FEATURES_FILE=  "features.raw"
+    CLASSES_FILE=   "classes.raw"
+    SETTINGS_FILE=  "store.json"
+    def __init__( self, path ):
+        self.path= path
+        if not os.path.isdir( path ):
+            os.makedirs( path )
+        self.feature_size= None
+        settings_path= os.path.join( path, self.SETTINGS_FILE )
+        if os.path.exists( settings_path ):
+            with open( settings_path ) as f:
+                self.feature_size= json.load( f )["feature_size"]
+
+    def append( self, features, classes ):
+        features= numpy.ascontiguousarray( features, dtype=FEATURE_DATATYPE )
+        classes=  numpy.ascontiguousarray( classes,  dtype=CLASS_DATATYPE )
+        if self.feature_size is None:
+            self.feature_size= features.shape[1]
+            with open( os.path.join(self.path, self.SETTINGS_FILE), 'w' ) as f:
+                json.dump( {"feature_size":self.feature_size}, f )
+        if features.shape[1]!=self.feature_size:
+            raise Exception("expected features of size "+str(self.feature_size)+", got "+str(features.shape[1]))
+        with open( os.path.join(self.path, self.FEATURES_FILE), 'ab' ) as f:
+            features.tofile( f )
+        with open( os.path.join(self.path, self.CLASSES_FILE), 'ab' ) as f:
+            classes.tofile( f )
+
+    def __len__( self ):
+        if self.feature_size is None:
+            return 0
+        size= os.path.getsize( os.path.join(self.path, self.FEATURES_FILE) )
+        return size // (self.feature_size*numpy.dtype(FEATURE_DATATYPE).itemsize)
+
+    def arrays( self ):
+        n= len(self)
+        if not n:
+            raise Exception("empty feature store")
+        features= numpy.memmap( os.path.join(self.path, self.FEATURES_FILE), dtype=FEATURE_DATATYPE, mode='r', shape=(n, self.feature_size) )
+        classes=  numpy.memmap( os.path.join(self.path, self.CLASSES_FILE),  dtype=CLASS_DATATYPE,   mode='r', shape=(n, 1) )
+        return features, classes
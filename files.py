@@ -1,6 +1,7 @@
 import os
 import cv2
-from tesseract_utils import read_boxfile, write_boxfile
+import threading
+import collections
 
 IMAGE_EXTENSIONS= ['.png','.tif','.jpg', '.jpeg']
 DATA_DIRECTORY= 'data/'
@@ -25,6 +26,52 @@ def try_extensions( path, extensions ):
             return p
     return None
 
+class ImageCache( object ):
+    '''A process-wide LRU cache of decoded images, bounded by their
+    total size in bytes. Images are keyed by path and modification 
+    time. Cached images are shared, and must not be modified in place'''
+    def __init__( self, max_bytes ):
+        self.max_bytes= max_bytes
+        self._images= collections.OrderedDict() #least recently used first
+        self._lock= threading.Lock()
+        self.bytes= 0
+        self.hits= 0
+        self.misses= 0
+
+    def get( self, path, load_function=cv2.imread ):
+        '''returns the decoded image on path, using load_function 
+        (on a miss)'''
+        key= (path, os.path.getmtime(path))
+        with self._lock:
+            image= self._images.pop( key, None )
+            if image is not None:
+                self.hits+= 1
+                self._images[key]= image
+                return image
+            self.misses+= 1
+        image= load_function( path ) #outside the lock - may take a while
+        if image is not None and image.nbytes <= self.max_bytes:
+            with self._lock:
+                if key not in self._images:
+                    self._images[key]= image
+                    self.bytes+= image.nbytes
+                while self.bytes > self.max_bytes:
+                    _, evicted= self._images.popitem( last=False )
+                    self.bytes-= evicted.nbytes
+        return image
+
+    def clear( self ):
+        with self._lock:
+            self._images.clear()
+            self.bytes= 0
+
+    def stats( self ):
+        '''returns a dict with the cache hits, misses, number of images
+        and bytes'''
+        return {"hits":self.hits, "misses":self.misses, "images":len(self._images), "bytes":self.bytes, "max_bytes":self.max_bytes}
+
+IMAGE_CACHE= ImageCache( max_bytes=256*2**20 ) #set max_bytes to 0 to disable
+
 class GroundFile( object ):
     def __init__(self, path):
         self.path=      path
@@ -32,30 +79,54 @@ class GroundFile( object ):
         self.classes=    None
 
     def read(self):
+        from tesseract_utils import read_boxfile #lazily: it imports the segmentation and classification modules
         self.classes, self.segments= read_boxfile( self.path )
 
     def write(self):
+        from tesseract_utils import write_boxfile
         write_boxfile( self.path, self.classes, self.segments )
 
 
 class ImageFile( object ):
     '''An OCR image file. Has an image and its file path, and optionally 
-    a ground (ground segments and classes) and it's file path'''
-    def __init__( self, image_path):
+    a ground (ground segments and classes) and it's file path.
+    The image and ground are only read when first used; images go
+    through IMAGE_CACHE unless cached is False (for images read only 
+    once, that would just fill the cache)'''
+    def __init__( self, image_path, cached=True ):
         good_path= try_extensions( image_path, IMAGE_EXTENSIONS ) 
-        good_path= try_extensions( os.path.join( DATA_DIRECTORY, image_path ), IMAGE_EXTENSIONS )
+        if not good_path:
+            good_path= try_extensions( os.path.join( DATA_DIRECTORY, image_path ), IMAGE_EXTENSIONS )
         if not good_path:
             raise Exception( "could not find file: "+image_path)
         self.image_path=     good_path
-        self.image= cv2.imread(self.image_path)
+        self.cached= cached
+        self._image= None
         basename= split_extension(good_path)[0]
         self.ground_path=    try_extensions( basename, GROUND_EXTENSIONS )
         if self.ground_path:
-            self.ground= GroundFile(self.ground_path)
-            self.ground.read()
+            self._ground= None #not read yet
         else:
             self.ground_path= basename+GROUND_EXTENSIONS_DEFAULT
-            self.ground=None
+            self._ground= False #no ground
+
+    @property
+    def image( self ):
+        if self._image is None:
+            self._image= IMAGE_CACHE.get( self.image_path ) if self.cached else cv2.imread( self.image_path )
+        return self._image
+
+    @property
+    def ground( self ):
+        if self._ground is None:
+            ground= GroundFile(self.ground_path)
+            ground.read()
+            self._ground= ground
+        return self._ground or None
+
+    @ground.setter
+    def ground( self, ground ):
+        self._ground= ground if ground is not None else False
 
     def isGrounded(self):
         '''checks if this file is grounded'''
@@ -0,0 +1,232 @@
+'''Frame sources (multi-page images, videos) and change-aware OCR of
+frame sequences, where consecutive frames are mostly the same'''
+
+from segmentation_aux import SegmentOrderer
+from segmentation_filters import EmptySegmentationError
+from segment_table import SegmentTable
+from image_context import image_context
+from files import split_extension
+import numpy
+import cv2
+
+VIDEO_EXTENSIONS= ['.avi', '.mp4', '.mkv', '.mov', '.webm']
+
+class FrameSource( object ):
+    '''a sequence of images (frames). Iterating yields (index, image),
+    reading one frame at a time where the format allows it'''
+    def __iter__( self ):
+        raise NotImplementedError()
+
+class MultiPageImage( FrameSource ):
+    '''the pages of a multi-page image file (tiff). With opencv 4.5.4 
+    or newer (which has cv2.imcount), pages are decoded one at a time.
+    Older versions can only decode all the pages at once, up front, so
+    there memory use grows with the page count'''
+    def __init__( self, path ):
+        self.path= path
+
+    def __iter__( self ):
+        if hasattr( cv2, "imcount" ):
+            return self._read_pages()
+        ok, pages= cv2.imreadmulti( self.path, flags=cv2.IMREAD_COLOR )
+        if not ok:
+            raise Exception("could not read image file: "+self.path)
+        return enumerate( pages )
+
+    def _read_pages( self ):
+        count= cv2.imcount( self.path )
+        if not count:
+            raise Exception("could not read image file: "+self.path)
+        for index in range(count):
+            ok, pages= cv2.imreadmulti( self.path, index, 1, flags=cv2.IMREAD_COLOR )
+            if not ok:
+                raise Exception("could not read page {0} of image file: {1}".format(index, self.path))
+            yield index, pages[0]
+
+class VideoFrames( FrameSource ):
+    '''the frames of a video file (or device number), as read by
+    cv2.VideoCapture. Only every step-th frame is yielded; the index is
+    the frame number'''
+    def __init__( self, source, step=1 ):
+        self.source= source
+        self.step= step
+
+    def __iter__( self ):
+        capture= cv2.VideoCapture( self.source )
+        if not capture.isOpened():
+            raise Exception("could not open video: "+str(self.source))
+        try:
+            index= 0
+            while True:
+                if index%self.step:
+                    if not capture.grab():
+                        break
+                else:
+                    ok, frame= capture.read()
+                    if not ok:
+                        break
+                    yield index, frame
+                index+= 1
+        finally:
+            capture.release()
+
+def open_frames( path ):
+    '''a FrameSource for path, chosen by its extension'''
+    if split_extension( path )[1].lower() in VIDEO_EXTENSIONS:
+        return VideoFrames( path )
+    return MultiPageImage( path )
+
+class ChangeAwareOCR( object ):
+    '''ocrs a sequence of frames with a trained OCR, reusing the
+    results of the previous frame where it didn't change.
+    Frames are compared, in blocks of block_size pixels, with the
+    reference: the frame last ocred, updated with the regions ocred
+    since. A block changed if any of its (grayscale) pixels differs by
+    more than threshold, so slow changes (fades, scrolls) add up until
+    they're noticed. If no block changed, the previous results are 
+    returned as they are.
+    If more than max_changed (a fraction) of the blocks changed, or the
+    frame size did, the whole frame is ocred. Otherwise, only regions
+    around the changed blocks (grown by margin blocks, and to include
+    the previous segments they touch) are segmented, and only their
+    segments are classified. Regions are segmented with context pixels
+    around them (for blurring and thresholding), keeping only the
+    segments inside them. Still, segmenting a region on its own can give
+    different results than segmenting the whole frame, if the segmenter
+    filters depend on the rest of the page - use max_changed=0 to
+    disable region reprocessing. Lossy video frames may need a higher
+    threshold, so that compression noise isn't taken for changes.
+    Regions are segmented with region_segmenter, which defaults to the
+    OCR segmenter. LineFinder's "kmeans" line_method (the default) 
+    fails on regions with few segments, so with it, regions are never
+    reprocessed: use a region_segmenter with line_method="gaps".
+    If segmenting a region fails, the whole frame is ocred; these 
+    frames are counted in fallback_frames, not full_frames'''
+    def __init__( self, ocr, block_size=32, threshold=32, margin=1, context=16, max_changed=0.5, region_segmenter=None ):
+        self.base_ocr= ocr
+        self.region_segmenter= region_segmenter or ocr.segmenter
+        self.regions_supported= self.region_segmenter.get_parameters().get( "line_method" )!="kmeans"
+        self.block_size= block_size
+        self.threshold= threshold
+        self.margin= margin
+        self.context= context
+        self.max_changed= max_changed
+        processors= getattr( ocr.segmenter, "processors", [] )
+        self._orderer= ([p for p in processors if isinstance(p, SegmentOrderer)] or [SegmentOrderer()])[-1]
+        self.reset()
+
+    def reset( self ):
+        '''forgets the previous frame'''
+        self._gray, self._classes, self._segments= None, None, None
+        self._result= None #(classes, segments as a n*4 array), as returned
+        self.full_frames, self.partial_frames, self.unchanged_frames, self.fallback_frames= 0, 0, 0, 0
+
+    def _changed_blocks( self, gray ):
+        bs= self.block_size
+        changed= cv2.absdiff( gray, self._gray ) > self.threshold
+        h, w= changed.shape
+        padded= numpy.zeros( (-(-h//bs)*bs, -(-w//bs)*bs), dtype=bool )
+        padded[:h,:w]= changed
+        return padded.reshape( padded.shape[0]//bs, bs, padded.shape[1]//bs, bs ).any( axis=3 ).any( axis=1 )
+
+    def _changed_regions( self, blocks, shape ):
+        '''(x, y, x2, y2) rectangles covering the changed blocks and the
+        previous segments they touch, not overlapping each other'''
+        bs, m= self.block_size, self.margin
+        blocks= blocks.astype( numpy.uint8 )
+        if m:
+            blocks= cv2.dilate( blocks, numpy.ones( (2*m+1, 2*m+1), dtype=numpy.uint8 ) )
+        stats= cv2.connectedComponentsWithStats( blocks, connectivity=8 )[2][1:]
+        h, w= shape
+        regions= [[x*bs, y*bs, min((x+bw)*bs, w), min((y+bh)*bs, h)] for x, y, bw, bh in stats[:, :4].tolist()]
+        s= self._segments
+        grown= True
+        while grown: #grow to the touched segments, and merge overlapping regions, until stable
+            grown= False
+            for r in regions:
+                touched= (s.x < r[2]) & (s.x2 > r[0]) & (s.y < r[3]) & (s.y2 > r[1])
+                if touched.any():
+                    new= [min(r[0], s.x[touched].min()), min(r[1], s.y[touched].min()), max(r[2], s.x2[touched].max()), max(r[3], s.y2[touched].max())]
+                    if new!=r:
+                        r[:]= map( int, new )
+                        grown= True
+            merged= []
+            for r in regions:
+                for o in merged:
+                    if r[0] < o[2] and o[0] < r[2] and r[1] < o[3] and o[1] < r[3]:
+                        o[:]= [min(r[0],o[0]), min(r[1],o[1]), max(r[2],o[2]), max(r[3],o[3])]
+                        grown= True
+                        break
+                else:
+                    merged.append( r )
+            regions= merged
+        return regions
+
+    def _ocr_regions( self, image, regions ):
+        '''ocrs the regions of image, reusing the previous results
+        everywhere else'''
+        s= self._segments
+        h, w= image.shape[:2]
+        keep= numpy.ones( len(s), dtype=bool )
+        found= []
+        for x, y, x2, y2 in regions:
+            keep&= ~((s.x >= x) & (s.x2 <= x2) & (s.y >= y) & (s.y2 <= y2))
+            cx, cy= max(x-self.context, 0), max(y-self.context, 0)
+            crop= image[cy:min(y2+self.context, h), cx:min(x2+self.context, w)]
+            try:
+                r= SegmentTable.wrap( self.region_segmenter.process( numpy.ascontiguousarray( crop ) ) )
+            except EmptySegmentationError: #everything there was erased
+                continue
+            r= SegmentTable( r.x+cx, r.y+cy, r.w, r.h )
+            found.append( r[ (r.x >= x) & (r.x2 <= x2) & (r.y >= y) & (r.y2 <= y2) ] )
+        new_segments= SegmentTable.concatenate( found ) if found else SegmentTable.from_rows( [] )
+        if len(new_segments):
+            new_classes= self.base_ocr.classifier.classify( self.base_ocr.feature_extractor.extract( image, new_segments ) )
+        else:
+            new_classes= self._classes[:0]
+        segments= SegmentTable.concatenate( [s[keep], new_segments] )
+        classes= numpy.concatenate( [self._classes[keep], new_classes] )
+        order= self._orderer.order( segments )
+        return classes[order], segments[order]
+
+    def ocr( self, image ):
+        '''returns (classes, segments) of image, a frame following the
+        previous one given'''
+        self.base_ocr._train_from_store()
+        gray= image_context( image ).gray
+        fell_back= False
+        if self._gray is not None and self._gray.shape==gray.shape:
+            blocks= self._changed_blocks( gray )
+            if not blocks.any():
+                self.unchanged_frames+= 1
+                return self._result
+            if self.regions_supported and blocks.mean() <= self.max_changed:
+                regions= self._changed_regions( blocks, gray.shape )
+                try:
+                    self._classes, self._segments= self._ocr_regions( image, regions )
+                    self.partial_frames+= 1
+                    for x, y, x2, y2 in regions: #only what was reprocessed
+                        self._gray[y:y2, x:x2]= gray[y:y2, x:x2]
+                    self._result= self._classes, numpy.array( self._segments )
+                    return self._result
+                except cv2.error: #a region can't be segmented on its own
+                    fell_back= True
+        if fell_back:
+            self.fallback_frames+= 1
+        else:
+            self.full_frames+= 1
+        segments= self.base_ocr.segmenter.process( image )
+        self._segments= SegmentTable.wrap( segments )
+        classes= self.base_ocr.classifier.classify( self.base_ocr.feature_extractor.extract( image, self._segments ) )
+        self._gray= gray.copy() #the reference is updated in place
+        self._classes= classes
+        self._result= classes, numpy.array( segments )
+        return self._result
+
+    def ocr_frames( self, frames ):
+        '''ocrs each frame of a FrameSource (or any iterable of
+        (index, image)) in turn. This is a generator: it yields
+        (index, classes, segments)'''
+        for index, image in frames:
+            classes, segments= self.ocr( image )
+            yield index, classes, segments
@@ -0,0 +1,76 @@
+'''per image analysis (grayscale, background, thresholding, contours),
+computed lazily and only once, and shared by everything that processes
+the same image object'''
+
+from opencv_utils import background_color
+import threading
+import weakref
+import cv2
+
+class ImageContext( object ):
+    '''The analyses of a image. Only a weak reference to the image is
+    kept; the context lives as long as the image does. The image must
+    not be modified in place after the context is created'''
+    def __init__( self, image, on_collect=None ):
+        self._image= weakref.ref( image, on_collect )
+        self._gray= None
+        self._background= None
+        self._binary= (None, None)   #((block_size, c), binary image) - only the last one, so memory is bounded
+        self._contours= (None, None) #((block_size, c), (contours, hierarchy))
+
+    @property
+    def image( self ):
+        return self._image()
+
+    @property
+    def gray( self ):
+        '''the grayscale image'''
+        image= self.image
+        if image.ndim==2: #not kept: the context must not hold a (strong) reference to its image
+            return image
+        if self._gray is None:
+            self._gray= cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def background( self ):
+        '''background_color of the grayscale image'''
+        if self._background is None:
+            self._background= background_color( self.gray )
+        return self._background
+
+    def binary( self, block_size, c ):
+        '''the adaptive (gaussian) threshold of the grayscale image.
+        Only the one for the last (block_size, c) is kept'''
+        key= (block_size, c)
+        if self._binary[0]!=key:
+            self._binary= key, cv2.adaptiveThreshold(self.gray, maxValue=255, adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C, thresholdType=cv2.THRESH_BINARY, blockSize=block_size, C=c)
+        return self._binary[1]
+
+    def contours( self, block_size, c ):
+        '''(contours, hierarchy) of the binary image. Only the ones for
+        the last (block_size, c) are kept'''
+        key= (block_size, c)
+        if self._contours[0]!=key:
+            binary= self.binary( block_size, c ).copy() #older opencv versions modify it
+            self._contours= key, tuple( cv2.findContours(binary,cv2.RETR_LIST,cv2.CHAIN_APPROX_SIMPLE)[-2:] )
+        return self._contours[1]
+
+_contexts= {} #id(image) -> ImageContext
+_contexts_lock= threading.RLock() #reentrant: _forget may run on garbage collection, while it is held
+
+def image_context( image ):
+    '''returns the ImageContext of a image, creating it if needed.
+    It's forgotten when the image is garbage collected'''
+    key= id(image)
+    with _contexts_lock:
+        context= _contexts.get( key )
+        if context is None or context.image is not image:
+            context= _contexts[key]= ImageContext( image, lambda ref: _forget(key, ref) )
+        return context
+
+def _forget( key, image_ref ):
+    with _contexts_lock:
+        context= _contexts.get( key )
+        if context is not None and context._image is image_ref:
+            del _contexts[key]
@@ -0,0 +1,50 @@
+'''Inference only entry point: ocrs image files with a model saved by
+OCR.save, importing only the modules the model names, and what they
+import (no grounding, tesseract or training modules):
+
+    python -m inference MODEL_DIRECTORY image1.png image2.png ...
+
+Prints "path<TAB>text" per file, or json lines with --json. With
+--workers, images are ocred on a pool of worker processes'''
+
+import sys
+
+def load( model_path ):
+    '''the OCR saved at model_path; see OCR.load'''
+    from ocr import OCR #lazily, so importing this module is fast
+    return OCR.load( model_path )
+
+def ocr_files( model_path, paths, workers=1 ):
+    '''yields (path, classes, segments, error) for each of the image
+    paths, in order; see OCR.ocr_batch. With workers=1, everything
+    runs on this process'''
+    return load( model_path ).ocr_batch( paths, workers=workers )
+
+def main( argv=None ):
+    import argparse
+    import json
+    import numpy
+    parser= argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( "model", help="directory of a model saved with OCR.save" )
+    parser.add_argument( "paths", nargs="+", help="image files" )
+    parser.add_argument( "--workers", type=int, default=1, help="number of worker processes" )
+    parser.add_argument( "--json", action="store_true", help="print classes and segments too, as json lines" )
+    args= parser.parse_args( argv )
+    failed= 0
+    for path, classes, segments, error in ocr_files( args.model, args.paths, args.workers ):
+        if error is not None:
+            failed+= 1
+            sys.stderr.write( "{0}: {1}\n".format(path, error.strip().splitlines()[-1]) )
+            if args.json:
+                print json.dumps( {"path":path, "error":error} )
+            continue
+        classes= [int(c) for c in classes.ravel()]
+        text= u"".join( map(unichr, classes) ).encode( "utf-8" )
+        if args.json:
+            print json.dumps( {"path":path, "text":text, "classes":classes, "segments":numpy.array(segments).tolist()} )
+        else:
+            print path+"\t"+text
+    return 1 if failed else 0
+
+if __name__=="__main__":
+    sys.exit( main() )
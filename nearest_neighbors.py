@@ -0,0 +1,143 @@
+import numpy
+
+class NearestNeighborsIndex( object ):
+    '''finds the k nearest (squared euclidean distance) rows of some
+    data to each of some query rows'''
+    def build( self, data ):
+        '''indexes data, a n*d array'''
+        raise NotImplementedError()
+
+    def query( self, queries, k ):
+        '''given a m*d array, returns (distances, indexes), both m*k,
+        with the squared distances to the k nearest data rows, nearest
+        first, and their row numbers'''
+        raise NotImplementedError()
+
+    def get_settings( self ):
+        '''returns the constructor arguments of this index'''
+        raise NotImplementedError()
+
+class BruteForceIndex( NearestNeighborsIndex ):
+    '''compares each query to all the data, expanding
+    |q-x|**2 = |q|**2 - 2*q.x + |x|**2, so that most of the work is a
+    (BLAS) matrix product. Queries are processed in chunks, so that the
+    distance matrices have at most chunk_elements elements'''
+    def __init__( self, chunk_elements=2**22 ):
+        self.chunk_elements= chunk_elements
+
+    def get_settings( self ):
+        return {"chunk_elements":self.chunk_elements}
+
+    def build( self, data ):
+        self.data= data
+        self.data_norms= numpy.einsum( 'ij,ij->i', data, data )
+
+    def query( self, queries, k ):
+        m, n= len(queries), len(self.data)
+        k= min( k, n )
+        distances= numpy.empty( (m,k), dtype=self.data_norms.dtype )
+        indexes= numpy.empty( (m,k), dtype=numpy.intp )
+        chunk= max( 1, self.chunk_elements//max(n,1) )
+        for start in range(0, m, chunk):
+            q= queries[start:start+chunk]
+            d= numpy.dot( q, self.data.T )
+            d*= -2
+            d+= self.data_norms
+            d+= numpy.einsum( 'ij,ij->i', q, q )[:,None]
+            numpy.maximum( d, 0, out=d ) #rounding errors
+            if k<n:
+                nearest= numpy.argpartition( d, k-1, axis=1 )[:,:k]
+            else:
+                nearest= numpy.tile( numpy.arange(n), (len(q),1) )
+            nearest_d= d[ numpy.arange(len(q))[:,None], nearest ]
+            order= numpy.argsort( nearest_d, axis=1, kind='mergesort' )
+            rows= numpy.arange(len(q))[:,None]
+            distances[start:start+chunk]= nearest_d[rows, order]
+            indexes[start:start+chunk]= nearest[rows, order]
+        return distances, indexes
+
+class KDTreeIndex( NearestNeighborsIndex ):
+    '''a k-d tree. Only worth it on low dimensional data; the search
+    runs a (python) loop per query'''
+    def __init__( self, leaf_size=32 ):
+        self.leaf_size= leaf_size
+
+    def get_settings( self ):
+        return {"leaf_size":self.leaf_size}
+
+    def build( self, data ):
+        self.data= data
+        self.order= numpy.arange( len(data) ) #leaves are ranges of this
+        #nodes are described by these lists. split_dimension is -1 on leaves
+        self.split_dimension, self.split_value= [], []
+        self.children, self.ranges= [], []
+        pending= [(self._new_node(0, len(data)), 0, len(data))]
+        while pending:
+            node, start, end= pending.pop()
+            if end-start <= self.leaf_size:
+                continue
+            points= data[ self.order[start:end] ]
+            dimension= numpy.argmax( points.max(axis=0)-points.min(axis=0) )
+            middle= (end-start)//2
+            partition= numpy.argpartition( points[:,dimension], middle )
+            self.order[start:end]= self.order[start:end][partition]
+            left=  self._new_node( start, start+middle )
+            right= self._new_node( start+middle, end )
+            self.split_dimension[node]= dimension
+            self.split_value[node]= data[ self.order[start+middle], dimension ]
+            self.children[node]= (left, right)
+            pending.append( (left, start, start+middle) )
+            pending.append( (right, start+middle, end) )
+
+    def _new_node( self, start, end ):
+        self.split_dimension.append( -1 )
+        self.split_value.append( None )
+        self.children.append( None )
+        self.ranges.append( (start, end) )
+        return len(self.ranges)-1
+
+    def _query_one( self, q, k ):
+        best_d= numpy.empty( 0 )
+        best_i= numpy.empty( 0, dtype=numpy.intp )
+        pending= [(0, 0.0)] #node, lower bound of the distance to it
+        while pending:
+            node, bound= pending.pop()
+            if len(best_d)==k and bound > best_d[-1]:
+                continue
+            dimension= self.split_dimension[node]
+            if dimension==-1:
+                start, end= self.ranges[node]
+                i= self.order[start:end]
+                d= self.data[i]-q
+                d= numpy.einsum( 'ij,ij->i', d, d )
+                best_d= numpy.append( best_d, d )
+                best_i= numpy.append( best_i, i )
+                nearest= numpy.argsort( best_d, kind='mergesort' )[:k]
+                best_d, best_i= best_d[nearest], best_i[nearest]
+            else:
+                difference= q[dimension]-self.split_value[node]
+                left, right= self.children[node]
+                near, far= (left, right) if difference<0 else (right, left)
+                pending.append( (far, max(bound, float(difference)**2)) )
+                pending.append( (near, bound) )
+        return best_d, best_i
+
+    def query( self, queries, k ):
+        k= min( k, len(self.data) )
+        distances= numpy.empty( (len(queries),k), dtype=self.data.dtype )
+        indexes= numpy.empty( (len(queries),k), dtype=numpy.intp )
+        for j,q in enumerate(queries):
+            distances[j], indexes[j]= self._query_one( q, k )
+        return distances, indexes
+
+INDEXES= {"brute":BruteForceIndex, "kdtree":KDTreeIndex}
+
+def majority_vote( neighbor_classes ):
+    '''given a m*k array of the classes of each row's k nearest
+    neighbours (nearest first), returns the most common class in each
+    row. Ties go to the class of the nearest neighbour'''
+    votes= numpy.zeros( neighbor_classes.shape, dtype=numpy.intp )
+    for j in range( neighbor_classes.shape[1] ):
+        votes[:,j]= numpy.sum( neighbor_classes==neighbor_classes[:,j:j+1], axis=1 )
+    winner= numpy.argmax( votes, axis=1 ) #first maximum - the nearest
+    return neighbor_classes[ numpy.arange(len(winner)), winner ]
@@ -1,8 +1,15 @@
-from opencv_utils import show_image_and_wait_for_key, draw_segments
+from files import ImageFile
+import threading
+import traceback
+import Queue
+import sys
+import importlib
+import json
+import os
 import numpy
-import cv2
 
 def show_differences( image, segments, ground_classes, result_classes):
+    from opencv_utils import show_image_and_wait_for_key, draw_segments #lazily: not needed for inference
     image= image.copy()
     good= (ground_classes==result_classes)
     good.shape= (len(good),) #transform nx1 matrix into vector
@@ -21,25 +28,237 @@ def accuracy( expected, result ):
     correct= expected==result
     return float(numpy.count_nonzero(correct))/correct.shape[0]
 
+_batch_ocr= None #the OCR instance of a ocr_batch worker process
+
+def _init_batch_worker( ocr, cache_images=False ):
+    '''ocr_batch worker initializer. Runs once per worker process'''
+    global _batch_ocr, _batch_cache_images
+    _batch_ocr, _batch_cache_images= ocr, cache_images
+
+def _batch_worker( path ):
+    '''ocrs a single path on a ocr_batch worker. Errors are returned 
+    (as a traceback string) instead of raised, so that one bad file 
+    doesn't kill the whole batch'''
+    try:
+        classes, segments= _batch_ocr.ocr( ImageFile(path, cached=_batch_cache_images) )
+        return path, classes, segments, None
+    except Exception:
+        return path, None, None, traceback.format_exc()
+
+
+_DECODING_DONE= None #put on the queue by each ocr_stream I/O thread when it's done
+
+def _decode_ahead( paths, paths_lock, queue, stop, cache_images ):
+    '''ocr_stream I/O thread: takes paths from the (shared) paths 
+    iterator and puts (path, ImageFile, exc_info) on the queue'''
+    while not stop.is_set():
+        with paths_lock:
+            try:
+                path= next(paths)
+            except StopIteration:
+                break
+        try:
+            image_file= ImageFile(path, cached=cache_images)
+            image_file.image #decode now, on this thread
+            queue.put( (path, image_file, None) )
+        except Exception:
+            queue.put( (path, None, sys.exc_info()) )
+    queue.put( _DECODING_DONE )
+
+MODEL_SETTINGS_FILE= "model.json"
+MODEL_FEATURES_FILE= "features.npy"
+MODEL_CLASSES_FILE=  "classes.npy"
+
+def _settings( instance ):
+    '''get_settings, or the parameters of processors that have no 
+    other settings'''
+    if hasattr( instance, "get_settings" ):
+        return instance.get_settings()
+    return instance.get_parameters()
+
+def _describe( instance ):
+    '''json-able description of a instance, for OCR.save. Settings 
+    that are processors (a ContourSegmenter raw_segmenter) are 
+    described too'''
+    cls= instance.__class__
+    if cls.__module__=="__main__":
+        raise Exception("can't describe "+cls.__name__+": classes defined in __main__ can't be imported on load")
+    settings= dict( (k, _describe(v) if hasattr(v, "get_parameters") else v) for k,v in _settings( instance ).items() )
+    return {"module":cls.__module__, "class":cls.__name__, "settings":settings}
+
+def _str_keys_and_values( d ):
+    '''json gives unicode strings, but Processor parameters are 
+    type checked against str'''
+    def to_str( x ):
+        if isinstance(x, unicode):
+            return str(x)
+        return _str_keys_and_values(x) if isinstance(x, dict) else x
+    return dict( (str(k), to_str(v)) for k,v in d.items() )
+
+def _instantiate( description ):
+    '''reverses _describe'''
+    module= importlib.import_module( description["module"] )
+    cls= getattr( module, description["class"] )
+    settings= _str_keys_and_values( description["settings"] )
+    for k,v in settings.items():
+        if isinstance(v, dict) and "module" in v and "class" in v:
+            settings[k]= _instantiate( v )
+    return cls( **settings )
 
 class OCR( object ):
-    def __init__( self, segmenter, feature_extractor, classifier):
+    def __init__( self, segmenter, feature_extractor, classifier, feature_store=None):
+        '''feature_store is used by partial_train; it defaults to a 
+        MemoryFeatureStore'''
         self.segmenter= segmenter
         self.feature_extractor= feature_extractor
         self.classifier= classifier
+        self.feature_store= feature_store
+        self._stale_classifier= feature_store is not None and len(feature_store)>0 #True if the store has features the classifier wasn't trained with
 
     def train( self, image_file ):
-        '''feeds the training data to the OCR'''
+        '''feeds the training data to the OCR. If the OCR has a feature
+        store, the data is added to it, like partial_train, and the
+        classifier is trained with everything in the store'''
+        if self.feature_store is not None:
+            self.partial_train( image_file )
+            self._train_from_store()
+            return
         if not image_file.isGrounded():
             raise Exception("The provided file is not grounded")
         features= self.feature_extractor.extract( image_file.image, image_file.ground.segments )
         self.classifier.train( features, image_file.ground.classes )
+
+    def partial_train( self, image_file ):
+        '''adds the training data of a file to the feature store. The
+        classifier is trained (with everything in the store) only when 
+        it's next needed. The first time, whatever the classifier was 
+        already trained with goes into the (empty) store too'''
+        from classification import Classifier #lazily: OCR.load imports only the modules the model uses
+        from feature_store import MemoryFeatureStore
+        if not image_file.isGrounded():
+            raise Exception("The provided file is not grounded")
+        if self.feature_store is None:
+            self.feature_store= MemoryFeatureStore()
+        if not len(self.feature_store) and hasattr(self.classifier, "features"):
+            self.feature_store.append( self.classifier.features, self.classifier.classes )
+        features= self.feature_extractor.extract( image_file.image, image_file.ground.segments )
+        self.feature_store.append( *Classifier._filter_unclassified( features, image_file.ground.classes ) )
+        self._stale_classifier= True
+
+    def train_many( self, image_files ):
+        '''partial_train on each of the files'''
+        for image_file in image_files:
+            self.partial_train( image_file )
+
+    def _train_from_store( self ):
+        if self._stale_classifier:
+            self.classifier.train( *self.feature_store.arrays() )
+            self._stale_classifier= False
+
+    def save( self, path ):
+        '''saves the trained OCR to the directory path: the training
+        features and classes as .npy files, and the settings of the 
+        segmenter, feature extractor and classifier as json. The 
+        segmenter is saved as its class and settings (for a 
+        ContourSegmenter, its raw segmenter too); a custom filter stack
+        can't be saved, and raises'''
+        self._train_from_store()
+        if not hasattr(self.classifier, "features"):
+            raise Exception("The OCR must be trained before saving")
+        settings= { #first: raises if something can't be described
+            "segmenter":         _describe( self.segmenter ),
+            "feature_extractor": _describe( self.feature_extractor ),
+            "classifier":        _describe( self.classifier ),
+            }
+        if not os.path.isdir( path ):
+            os.makedirs( path )
+        numpy.save( os.path.join(path, MODEL_FEATURES_FILE), self.classifier.features )
+        numpy.save( os.path.join(path, MODEL_CLASSES_FILE),  self.classifier.classes )
+        with open( os.path.join(path, MODEL_SETTINGS_FILE), 'w' ) as f:
+            json.dump( settings, f, indent=1, sort_keys=True )
+
+    @staticmethod
+    def load( path, mmap_mode='r' ):
+        '''loads a OCR saved with OCR.save, already trained. The 
+        features are memory mapped (unless mmap_mode is None), so 
+        loading is fast, and processes loading the same model share 
+        memory - as long as the classifier doesn't copy them'''
+        with open( os.path.join(path, MODEL_SETTINGS_FILE) ) as f:
+            settings= json.load( f )
+        ocr= OCR( *[_instantiate(settings[k]) for k in ("segmenter", "feature_extractor", "classifier")] )
+        features= numpy.load( os.path.join(path, MODEL_FEATURES_FILE), mmap_mode=mmap_mode )
+        classes=  numpy.load( os.path.join(path, MODEL_CLASSES_FILE) )
+        ocr.classifier.train( features, classes )
+        return ocr
         
     def ocr( self, image_file, show_steps=False ):
         '''performs ocr used trained classifier'''
+        self._train_from_store()
         segments= self.segmenter.process( image_file.image )
         if show_steps:
             self.segmenter.display()
         features= self.feature_extractor.extract( image_file.image , segments )
         classes= self.classifier.classify( features )
         return classes, segments
+
+    def ocr_stream( self, paths, io_threads=2, queue_size=4, cache_images=False ):
+        '''performs ocr on many image paths, while io_threads threads 
+        read and decode the next images. At most queue_size decoded 
+        images wait to be processed, so memory usage is bounded. This 
+        is a generator: it yields (path, classes, segments) as each 
+        image is done, which may not be in input order if io_threads>1.
+        Errors reading a image are raised here. Images don't go through
+        IMAGE_CACHE, unless cache_images'''
+        paths, paths_lock, stop= iter(paths), threading.Lock(), threading.Event()
+        queue= Queue.Queue( queue_size )
+        threads= [threading.Thread( target=_decode_ahead, args=(paths, paths_lock, queue, stop, cache_images) ) for _ in range(io_threads)]
+        for t in threads:
+            t.daemon= True
+            t.start()
+        try:
+            running= io_threads
+            while running:
+                item= queue.get()
+                if item is _DECODING_DONE:
+                    running-= 1
+                    continue
+                path, image_file, exc_info= item
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                classes, segments= self.ocr( image_file )
+                yield path, classes, segments
+        finally:
+            stop.set()
+            while any( t.is_alive() for t in threads ): #unblock them
+                try:
+                    queue.get( timeout=0.1 )
+                except Queue.Empty:
+                    pass
+
+    def ocr_batch( self, paths, workers=None, ordered=True, chunksize=1, cache_images=False ):
+        '''performs ocr on many image paths, using a pool of worker 
+        processes. The (trained) OCR is sent to each worker once, when 
+        the pool starts. This is a generator: it yields 
+        (path, classes, segments, error) tuples, either in input order
+        or, if ordered is False, as soon as each image is done. error 
+        is None on success; otherwise, it's the traceback string, and 
+        classes and segments are None.
+        workers defaults to the number of cpus; if it's 1, everything
+        runs on this process. Images don't go through IMAGE_CACHE, 
+        unless cache_images'''
+        self._train_from_store() #once, not on every worker
+        if workers==1:
+            _init_batch_worker( self, cache_images )
+            for path in paths:
+                yield _batch_worker( path )
+            return
+        import multiprocessing
+        pool= multiprocessing.Pool( workers, initializer=_init_batch_worker, initargs=(self, cache_images) )
+        try:
+            mapper= pool.imap if ordered else pool.imap_unordered
+            for result in mapper( _batch_worker, paths, chunksize ):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,287 @@
+'''A long running OCR worker: loads a saved model (see OCR.save) once, and
+answers OCR requests, one json object per line, on stdin/stdout or on a
+unix socket:
+
+    {"id": 1, "path": "data/digits2.png"}
+    {"id": 2, "image": "<base64 encoded png/jpg/... file>"}
+
+Each answer has the request id, and either "classes", "segments" and
+"text", or "error". Answers may come out of order. Requests that arrive
+together are segmented one by one; then the features of all their
+segments are extracted into one buffer, and classified as a single 
+batch.
+
+    python ocr_server.py MODEL_DIRECTORY [--socket PATH]
+'''
+
+from ocr import OCR
+from files import ImageFile
+from feature_extraction import SimpleFeatureExtractor, FEATURE_DATATYPE
+import SocketServer
+import threading
+import Queue
+import traceback
+import base64
+import numpy
+import json
+import sys
+import os
+import cv2
+
+_STOP= None #put on the requests queue by OCRServer.close
+
+class OCRServer( object ):
+    '''batches requests from any number of threads through a single
+    worker thread. Requests are dicts (see the module documentation);
+    answers are given to the callback passed to submit. Images read
+    from paths don't go through IMAGE_CACHE, unless cache_images'''
+    def __init__( self, ocr, batch_size=32, batch_wait=0.01, cache_images=False ):
+        self.ocr= ocr
+        self.batch_size= batch_size
+        self.batch_wait= batch_wait #seconds to wait for more requests, once one arrives
+        self.cache_images= cache_images
+        self._requests= Queue.Queue()
+        self._stopping= False
+        self._features= None #feature buffer, see _extract_batch
+        ocr._train_from_store()
+        self._worker= threading.Thread( target=self._work )
+        self._worker.daemon= True
+        self._worker.start()
+
+    def submit( self, request, callback ):
+        '''queues a request; callback(answer) will be called on the
+        worker thread'''
+        self._requests.put( (request, callback) )
+
+    def close( self ):
+        '''answers the requests already submitted, then stops the
+        worker thread'''
+        self._requests.put( _STOP )
+        self._worker.join()
+
+    def _next_batch( self ):
+        batch= []
+        try:
+            item= self._requests.get()
+            while item is not _STOP:
+                batch.append( item )
+                if len(batch)==self.batch_size:
+                    break
+                item= self._requests.get( timeout=self.batch_wait )
+            else:
+                self._stopping= True
+        except Queue.Empty:
+            pass
+        return batch
+
+    def _read_image( self, request ):
+        if "path" in request:
+            return ImageFile( request["path"], cached=self.cache_images ).image
+        image= cv2.imdecode( numpy.frombuffer( base64.b64decode(request["image"]), dtype=numpy.uint8 ), 1 )
+        if image is None:
+            raise Exception("could not decode the image")
+        return image
+
+    def _work( self ):
+        while not self._stopping:
+            batch= self._next_batch()
+            answered= set() #indexes on batch
+            try:
+                self._process_batch( batch, answered )
+            except Exception as e: #don't let one bad batch stop the server
+                traceback.print_exc()
+                for i, (request, callback) in enumerate(batch):
+                    if i not in answered:
+                        self._answer( callback, _error_answer( request, e ) )
+
+    @staticmethod
+    def _answer( callback, answer ):
+        try:
+            callback( answer )
+        except Exception:
+            traceback.print_exc()
+
+    def _extract_batch( self, done ):
+        '''the features of the segments of all the (image, segments) 
+        in done, one image after the other. A SimpleFeatureExtractor
+        writes them straight into a buffer reused across batches'''
+        extractor= self.ocr.feature_extractor
+        if not isinstance( extractor, SimpleFeatureExtractor ):
+            return numpy.concatenate( [extractor.extract( image, segments ) for image, segments in done] )
+        n= sum( len(segments) for image, segments in done )
+        columns= extractor.feature_size**2
+        if self._features is None or self._features.shape[0]<n or self._features.shape[1]!=columns:
+            self._features= numpy.empty( (n, columns), dtype=FEATURE_DATATYPE )
+        start= 0
+        for image, segments in done:
+            extractor.extract( image, segments, out=self._features[start:] )
+            start+= len(segments)
+        return self._features[:n]
+
+    def _process_batch( self, batch, answered ):
+        '''segments each image, then extracts and classifies the
+        features of all of them at once. Adds the indexes of the
+        requests answered to answered'''
+        done= [] #(index, request, callback, image, segments)
+        for i, (request, callback) in enumerate(batch):
+            try:
+                image= self._read_image( request )
+                done.append( (i, request, callback, image, self.ocr.segmenter.process( image )) )
+            except Exception as e:
+                answered.add( i )
+                self._answer( callback, _error_answer( request, e ) )
+        if not done:
+            return
+        classes= self.ocr.classifier.classify( self._extract_batch( [d[3:] for d in done] ) )
+        start= 0
+        for i, request, callback, image, segments in done:
+            image_classes= [int(c) for c in numpy.ravel( classes[start:start+len(segments)] )]
+            start+= len(segments)
+            answered.add( i )
+            self._answer( callback, {
+                "id":       request.get("id"),
+                "classes":  image_classes,
+                "segments": numpy.array( segments ).tolist(),
+                "text":     u"".join( map(unichr, image_classes) ),
+                } )
+
+def _error_answer( request, e ):
+    return {"id":request.get("id") if isinstance(request, dict) else None, "error":"{0}: {1}".format(e.__class__.__name__, e)}
+
+def serve_stdio( server, input=sys.stdin, output=sys.stdout ):
+    '''answers the requests read from input, until it's closed and all
+    of them are answered'''
+    lock= threading.Lock()
+    pending= [0]
+    all_answered= threading.Event()
+    all_answered.set()
+    def write( answer, submitted=True ):
+        with lock:
+            try:
+                output.write( json.dumps(answer)+"\n" )
+                output.flush()
+            except (IOError, OSError): #the client went away
+                pass
+            if submitted:
+                pending[0]-= 1
+                if not pending[0]:
+                    all_answered.set()
+    for line in iter( input.readline, "" ):
+        if not line.strip():
+            continue
+        try:
+            request= json.loads( line )
+        except ValueError as e:
+            write( {"id":None, "error":"invalid json: "+str(e)}, submitted=False )
+            continue
+        with lock:
+            pending[0]+= 1
+            all_answered.clear()
+        server.submit( request, write )
+    all_answered.wait()
+
+class _UnixRequestHandler( SocketServer.StreamRequestHandler ):
+    def handle( self ):
+        serve_stdio( self.server.ocr_server, self.rfile, self.wfile )
+
+class _UnixServer( SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+    daemon_threads= True
+
+def serve_unix( server, path ):
+    '''answers requests from any number of connections to the unix
+    socket at path, forever'''
+    if os.path.exists( path ):
+        os.remove( path )
+    unix_server= _UnixServer( path, _UnixRequestHandler )
+    unix_server.ocr_server= server
+    try:
+        unix_server.serve_forever()
+    finally:
+        unix_server.server_close()
+        os.remove( path )
+
+class OCRFuture( object ):
+    '''the answer to a OCRClient request, once it arrives'''
+    def __init__( self ):
+        self._done= threading.Event()
+        self._answer= None
+
+    def _set( self, answer ):
+        self._answer= answer
+        self._done.set()
+
+    def done( self ):
+        return self._done.is_set()
+
+    def result( self, timeout=None ):
+        '''waits for the answer and returns (classes, segments), or
+        raises if the server answered with a error'''
+        if not self._done.wait( timeout ):
+            raise Exception("timed out waiting for the OCR server")
+        if "error" in self._answer:
+            raise Exception( self._answer["error"] )
+        return self._answer["classes"], self._answer["segments"]
+
+class OCRClient( object ):
+    '''client of a OCR server listening on a unix socket. submit()
+    returns a OCRFuture right away, so a caller can have many requests
+    in flight (and the server can batch them); ocr() waits'''
+    def __init__( self, path ):
+        import socket
+        self._socket= socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        self._socket.connect( path )
+        self._file= self._socket.makefile( 'rwb' )
+        self._lock= threading.Lock()
+        self._futures= {}
+        self._next_id= 0
+        self._reader= threading.Thread( target=self._read_answers )
+        self._reader.daemon= True
+        self._reader.start()
+
+    def _read_answers( self ):
+        for line in iter( self._file.readline, "" ):
+            answer= json.loads( line )
+            with self._lock:
+                future= self._futures.pop( answer["id"], None )
+            if future is not None:
+                future._set( answer )
+        with self._lock: #connection closed
+            futures, self._futures= self._futures.values(), {}
+        for future in futures:
+            future._set( {"error":"connection to the OCR server closed"} )
+
+    def submit( self, path=None, image_bytes=None ):
+        '''requests the OCR of a image file path (as seen by the server)
+        or of the encoded image file contents'''
+        request= {"path":path} if path is not None else {"image":base64.b64encode(image_bytes)}
+        future= OCRFuture()
+        with self._lock:
+            request["id"]= self._next_id
+            self._next_id+= 1
+            self._futures[request["id"]]= future
+            self._file.write( json.dumps(request)+"\n" )
+            self._file.flush()
+        return future
+
+    def ocr( self, path=None, image_bytes=None, timeout=None ):
+        '''returns (classes, segments) as lists'''
+        return self.submit( path, image_bytes ).result( timeout )
+
+    def close( self ):
+        self._socket.close()
+
+if __name__=="__main__":
+    import argparse
+    parser= argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( "model", help="directory of a model saved with OCR.save" )
+    parser.add_argument( "--socket", help="unix socket path to listen on, instead of stdin/stdout" )
+    parser.add_argument( "--batch-size", type=int, default=32 )
+    args= parser.parse_args()
+    server= OCRServer( OCR.load(args.model), batch_size=args.batch_size )
+    try:
+        if args.socket:
+            serve_unix( server, args.socket )
+        else:
+            serve_stdio( server )
+    finally:
+        server.close()
@@ -1,61 +1,96 @@
-from numpy_utils import OverflowPreventer
 from processor import DisplayingProcessor, ProcessorStack
 import numpy
 import cv2
 
 class ImageProcessor( DisplayingProcessor ):
+    '''processes images. The input image is not modified, unless 
+    inplace is set (usually by a ProcessorStack that owns the image), 
+    in which case the output is written over it. If output_buffer is 
+    set, the output is written there. Processing that changes nothing
+    returns the input image itself (unless there's a output_buffer)'''
+    output_buffer= None
     def display( self, display_before=True ):
         if display_before:
             show_image_and_wait_for_key(self._input, "before "+self.__class__.__name__)
         show_image_and_wait_for_key(self._output,  "after " +self.__class__.__name__)
     def _process( self, image ):
-        return self._image_processing( image )
-    def _image_processing( self , image ):
+        out= self.output_buffer
+        if out is None and self.inplace:
+            out= image
+        return self._image_processing( image, out )
+    def _image_processing( self , image, out=None ):
+        '''returns the processed image, written on out if it's given'''
         raise NotImplementedError( str(self.__class__) )
 
+def _unchanged( image, out ):
+    '''the result of a processing that does nothing'''
+    if out is None or out is image:
+        return image
+    numpy.copyto( out, image )
+    return out
+
+_luts= {} #lookup tables, by (name, parameters)
+
+def _cached_lut( name, parameters, make_lut ):
+    key= (name, parameters)
+    lut= _luts.get( key )
+    if lut is None:
+        values= make_lut( numpy.arange(256, dtype=numpy.float64), *parameters )
+        lut= _luts[key]= numpy.clip( values, 0, 255 ).astype( numpy.uint8 )
+    return lut
+
+def _brightness_lut( values, brightness ):
+    return values + int(brightness*256)
+
+def _contrast_lut( values, scale, center ):
+    c= int(center*256)
+    if scale<=1:
+        return numpy.floor(values*scale) + int(c*(1-scale))
+    values= numpy.maximum( numpy.floor(values - c*(1 - 1/scale)), 0 )
+    return numpy.floor(values*scale)
+
+def change_brightness( image, brightness, out=None ):
+    '''returns the image with changed brightness, written on out if 
+    it's given. See BrightnessProcessor'''
+    assert image.dtype==numpy.uint8
+    assert -1<=brightness<=1
+    if int(brightness*256)==0:
+        return _unchanged( image, out )
+    return cv2.LUT( image, _cached_lut("brightness", (brightness,), _brightness_lut), out )
+
+def change_contrast( image, scale, center, out=None ):
+    '''returns the image with changed contrast, written on out if it's
+    given. See ContrastProcessor'''
+    assert image.dtype==numpy.uint8
+    if scale==1:
+        return _unchanged( image, out )
+    return cv2.LUT( image, _cached_lut("contrast", (scale, center), _contrast_lut), out )
+
 class BrightnessProcessor( ImageProcessor ):
     '''changes image brightness. 
     A brightness of -1 will make the image all black; 
     one of 1 will make the image all white'''
     PARAMETERS= ImageProcessor.PARAMETERS + {"brightness":0.0}
-    def _image_processing( self , image ):
-        b= self.brightness
-        assert image.dtype==numpy.uint8
-        assert -1<=b<=1
-        image= image.copy()
-        with OverflowPreventer(image) as img:
-            img+= int(b*256)
-        return image
+    def _image_processing( self , image, out=None ):
+        return change_brightness( image, self.brightness, out )
 
 class ContrastProcessor( ImageProcessor ):
     '''changes image contrast. a scale of 1 will make no changes'''
     PARAMETERS= ImageProcessor.PARAMETERS + {"scale":1.0, "center":0.5}
-    def _image_processing( self , image ):
-        assert image.dtype==numpy.uint8
-        image= image.copy()
-        s,c= self.scale, self.center
-        c= int(c*256)
-        with OverflowPreventer(image) as img:
-            if s<=1:
-                img*=s
-                img+= int(c*(1-s))
-            else:
-                img-=c*(1 - 1/s)
-                img*=s
-        return image
+    def _image_processing( self , image, out=None ):
+        return change_contrast( image, self.scale, self.center, out )
 
 class BlurProcessor( ImageProcessor ):
     '''changes image contrast. a scale of 1 will make no changes'''
     PARAMETERS= ImageProcessor.PARAMETERS + {"blur_x":0, "blur_y":0}
-    def _image_processing( self , image ):
+    def _image_processing( self , image, out=None ):
         assert image.dtype==numpy.uint8
-        image= image.copy()
         x,y= self.blur_x, self.blur_y
-        if x or y:
-            x+= (x+1)%2 #opencv needs a
-            y+= (y+1)%2 #odd number...
-            image = cv2.GaussianBlur(image,(x,y),0)
-        return image
+        if not (x or y):
+            return _unchanged( image, out )
+        x+= (x+1)%2 #opencv needs a
+        y+= (y+1)%2 #odd number...
+        return cv2.GaussianBlur(image,(x,y),0,out)
 
 def ask_for_key( return_arrow_keys=True ):
     key=128
@@ -67,8 +102,50 @@ def ask_for_key( return_arrow_keys=True ):
         key %= 256
     return key
 
-def background_color( image, numpy_result=True ):
-    result= numpy.median(numpy.median(image, 0),0).astype( numpy.int )
+def _column_medians( image, block_columns=256, block_rows=4096 ):
+    '''numpy.median(image, 0) of a uint8 image, in O(pixels), through
+    a histogram of each column (and channel). Columns are histogrammed
+    in blocks of block_columns, block_rows rows at a time, so that 
+    zeroing the bins is amortized and the temporary indexes are bounded'''
+    h= image.shape[0]
+    columns= image.reshape( h, -1 )
+    m= columns.shape[1]
+    histograms= numpy.empty( (m, 256), dtype=numpy.intp )
+    for first in range(0, m, block_columns):
+        block= columns[:, first:first+block_columns]
+        n= block.shape[1]
+        offsets= numpy.arange( n, dtype=numpy.intp )*256 #each column has its own 256 bins
+        counts= numpy.zeros( n*256, dtype=numpy.intp )
+        for start in range(0, h, block_rows):
+            counts+= numpy.bincount( (block[start:start+block_rows]+offsets).ravel(), minlength=n*256 )
+        histograms[first:first+n]= counts.reshape( n, 256 )
+    cumulative= numpy.cumsum( histograms, axis=1 )
+    #the value with rank r is the number of values whose cumulative count is <= r
+    low=  numpy.sum( cumulative <= (h-1)//2, axis=1 )
+    high= numpy.sum( cumulative <= h//2, axis=1 )
+    return ((low+high)/2.0).reshape( image.shape[1:] )
+
+def background_color( image, numpy_result=True, method="median", subsample=4, border=8 ):
+    '''estimates the image background color, as the median of the 
+    column medians. method "subsampled" only looks at every subsample
+    rows and columns; "border" only at the border pixels of the image
+    (within border pixels from the edges), taking their median'''
+    if method=="subsampled":
+        image= image[::subsample, ::subsample]
+    elif method=="border":
+        b= border
+        pixels= [image[:b], image[-b:], image[b:-b,:b], image[b:-b,-b:]]
+        image= numpy.concatenate( [p.reshape( (-1,)+image.shape[2:] ) for p in pixels] )
+        image= image.reshape( (1,)+image.shape ) #a single row: its "column medians" are the pixels
+    elif method!="median":
+        raise Exception("unknown background_color method: "+method)
+    if image.shape[0]==1:
+        column_medians= image[0]
+    elif image.dtype==numpy.uint8 and image.shape[0]>=256: #histograms aren't worth it on fewer rows
+        column_medians= _column_medians( image )
+    else:
+        column_medians= numpy.median(image, 0)
+    result= numpy.median(column_medians,0).astype( numpy.int )
     if not numpy_result:
         try:
             result= tuple(map(int, result))
@@ -1,3 +1,10 @@
+from timeit import default_timer
+import threading
+import json
+import os
+
+_profiler= None #the active ProcessorProfiler, if any
+
 def _same_type(a,b):
     type_correct=False
     if type(a)==type(b):
@@ -18,7 +25,10 @@ def _broadcast( src_processor, src_atr_name, dest_processors, dest_atr_name, tra
     for d in dest_processors:
         setattr(d, dest_atr_name, value )
 
-def create_broadcast( src_atr_name, dest_processors, dest_atr_name=None, transform_function= lambda x:x):
+def _identity( x ):
+    return x
+
+def create_broadcast( src_atr_name, dest_processors, dest_atr_name=None, transform_function=_identity):
     '''This method creates a function, intended to be called as a 
     Processor posthook, that copies some of the processor's attributes
     to other processors'''
@@ -36,12 +46,77 @@ class Parameters( dict ):
         d3.update(other)
         return d3
 
+def _sizes( x ):
+    '''(items, bytes) of a processor input or output. items is the 
+    length (number of segments, image rows), bytes is 0 for non-arrays'''
+    try:
+        items= len(x)
+    except TypeError:
+        items= 0
+    return items, getattr(x, "nbytes", 0)
+
+class ProcessorProfiler( object ):
+    '''Aggregates, per processor class, wall time, number of calls, 
+    and input and output sizes of Processor.process calls. If trace, 
+    it also keeps every call, as Chrome trace events (see 
+    chrome://tracing). Enable with enable_profiling'''
+    def __init__( self, trace=False ):
+        self.trace= trace
+        self.stats= {}
+        self.events= []
+        self._lock= threading.Lock()
+
+    def record( self, processor, start, end, arguments, output ):
+        name= processor.__class__.__name__
+        in_items, in_bytes= _sizes( arguments )
+        out_items, out_bytes= _sizes( output )
+        with self._lock:
+            s= self.stats.get( name )
+            if s is None:
+                s= self.stats[name]= dict.fromkeys( ("calls", "time", "input_items", "output_items", "input_bytes", "output_bytes"), 0 )
+            s["calls"]+= 1
+            s["time"]+= end-start
+            s["input_items"]+=  in_items
+            s["output_items"]+= out_items
+            s["input_bytes"]+=  in_bytes
+            s["output_bytes"]+= out_bytes
+            if self.trace:
+                self.events.append( {"name":name, "ph":"X", "ts":start*1e6, "dur":(end-start)*1e6, "pid":os.getpid(), "tid":threading.current_thread().ident, "args":{"input_items":in_items, "output_items":out_items}} )
+
+    def to_dict( self ):
+        '''the aggregated stats, per processor class name'''
+        with self._lock:
+            return dict( (k,dict(v)) for k,v in self.stats.items() )
+
+    def to_json( self ):
+        return json.dumps( self.to_dict(), indent=1, sort_keys=True )
+
+    def write_chrome_trace( self, path ):
+        with open( path, 'w' ) as f:
+            json.dump( {"traceEvents":self.events}, f )
+
+def enable_profiling( profiler=None ):
+    '''starts recording all Processor.process calls on profiler (by 
+    default, a new ProcessorProfiler), which is returned'''
+    global _profiler
+    _profiler= profiler if profiler is not None else ProcessorProfiler()
+    return _profiler
+
+def disable_profiling():
+    '''stops recording, returning the profiler that was used'''
+    global _profiler
+    profiler, _profiler= _profiler, None
+    return profiler
+
 class Processor( object ):
     '''In goes something, out goes another. Processor.process() models 
     the behaviour of a function, where there are some stored parameters 
     in the Processor instance. Further, it optionally calls arbitrary 
-    functions before and after processing (prehooks, posthooks)'''
+    functions before and after processing (prehooks, posthooks).
+    Processors that support it may modify their input if inplace is 
+    True'''
     PARAMETERS= Parameters()
+    inplace= False
     def __init__(self, **args):
         '''sets default parameters'''
         for k,v in self.PARAMETERS.items():
@@ -53,7 +128,7 @@ class Processor( object ):
     def get_parameters( self ):
         '''returns a dictionary with the processor's stored parameters'''
         parameter_names= self.PARAMETERS.keys()
-        parameter_values= [getattr(processor, n) for n in parameter_names]
+        parameter_values= [getattr(self, n) for n in parameter_names]
         return dict( zip(parameter_names, parameter_values ) )
         
     def set_parameters( self, **args ):
@@ -84,7 +159,12 @@ class Processor( object ):
         self._input= arguments
         for prehook in self._prehooks:
             prehook( self )
-        output= self._process(arguments)
+        if _profiler is None:
+            output= self._process(arguments)
+        else:
+            start= default_timer()
+            output= self._process(arguments)
+            _profiler.record( self, start, default_timer(), arguments, output )
         self._output= output
         for poshook in self._poshooks:
             poshook( self )
@@ -98,22 +178,31 @@ class DisplayingProcessor( Processor ):
         raise NotImplementedError
 
 class ProcessorStack( Processor ):
-    '''a stack of processors. Each processor's output is fed to the next'''
-    def __init__(self, processor_instances=[], **args):
+    '''a stack of processors. Each processor's output is fed to the next.
+    If memoize, each processor's output is kept, and reused while both
+    its input (the same object, not modified in place) and its 
+    parameters stay the same. Changing a parameter then only recomputes
+    the processors from the first changed one on.
+    If inplace (and not memoize), processors that support it modify 
+    their input whenever it's an intermediate result of the stack - 
+    never the stack input. Displaying intermediate results may then 
+    show them modified by later processors'''
+    def __init__(self, processor_instances=[], memoize=False, inplace=False, **args):
+        self.memoize= memoize
+        self.inplace_intermediates= inplace
         self.set_processor_stack( processor_instances )
         Processor.__init__(self, **args)
 
     def set_processor_stack( self, processor_instances ):
         assert all( isinstance(x, Processor) for x in processor_instances )
         self.processors= processor_instances
+        self._memo= [] #(input, parameters, output) of each processor
 
     def get_parameters( self ):
         '''gets from all wrapped processors'''
         d= {}
         for p in self.processors:
-            parameter_names= p.PARAMETERS.keys()
-            parameter_values= [getattr(p, n) for n in parameter_names]
-            d.update( dict(zip(parameter_names, parameter_values )) )
+            d.update( p.get_parameters() )
         return d
 
     def set_parameters( self, **args ):
@@ -127,8 +216,28 @@ class ProcessorStack( Processor ):
         return not_used, not_given
 
     def _process( self, arguments ):
-        for p in self.processors:
-            arguments= p.process( arguments )
+        if not self.memoize:
+            stack_input= arguments
+            for p in self.processors:
+                owned= self.inplace_intermediates and (self.inplace or arguments is not stack_input)
+                previous, p.inplace= p.inplace, owned
+                try:
+                    arguments= p.process( arguments )
+                finally:
+                    p.inplace= previous
+            return arguments
+        recomputing= False
+        for i,p in enumerate(self.processors):
+            parameters= p.get_parameters()
+            if not recomputing and i<len(self._memo):
+                memo_input, memo_parameters, memo_output= self._memo[i]
+                if memo_input is arguments and memo_parameters==parameters:
+                    arguments= memo_output
+                    continue
+            recomputing= True #all the following processors must run
+            output= p.process( arguments )
+            self._memo[i:]= [(arguments, parameters, output)]
+            arguments= output
         return arguments
 
 class DisplayingProcessorStack( ProcessorStack ):
@@ -0,0 +1,91 @@
+import numpy
+
+SEGMENT_COLUMN_DATATYPE= numpy.int32 #large enough for x+w on any image
+
+class SegmentTable( object ):
+    '''Segments (x,y,width,height rectangles), stored as one contiguous
+    array per column. The derived columns (x2, y2, area) are computed
+    when first used, and kept.
+    Behaves enough like a n*4 segments array for the segmentation code:
+    table[:,i] is a column, table[rows] or table[rows,:] a sub-table,
+    table[i] a (x,y,w,h) tuple, iteration gives (x,y,w,h) tuples of
+    ints and numpy.array(table) is the n*4 array'''
+    def __init__( self, x, y, w, h ):
+        self.x, self.y, self.w, self.h= [numpy.ascontiguousarray(c, dtype=SEGMENT_COLUMN_DATATYPE) for c in (x,y,w,h)]
+        self._x2, self._y2, self._area= None, None, None
+
+    @staticmethod
+    def from_rows( rows ):
+        '''from a n*4 array, or a list of 4-element tuples'''
+        rows= numpy.asarray( rows ).reshape(-1,4)
+        return SegmentTable( rows[:,0], rows[:,1], rows[:,2], rows[:,3] )
+
+    @staticmethod
+    def wrap( segments ):
+        '''returns segments as a SegmentTable, converting only if needed'''
+        return segments if isinstance(segments, SegmentTable) else SegmentTable.from_rows( segments )
+
+    @staticmethod
+    def concatenate( tables ):
+        '''one table with the rows of all the tables (or segment arrays)'''
+        tables= map( SegmentTable.wrap, tables )
+        return SegmentTable( *[numpy.concatenate( [t.columns[i] for t in tables] ) for i in range(4)] )
+
+    @property
+    def columns( self ):
+        return self.x, self.y, self.w, self.h
+
+    @property
+    def x2( self ):
+        if self._x2 is None:
+            self._x2= self.x+self.w
+        return self._x2
+
+    @property
+    def y2( self ):
+        if self._y2 is None:
+            self._y2= self.y+self.h
+        return self._y2
+
+    @property
+    def area( self ):
+        if self._area is None:
+            self._area= self.w.astype(numpy.int64)*self.h
+        return self._area
+
+    @property
+    def shape( self ):
+        return (len(self), 4)
+
+    @property
+    def nbytes( self ):
+        return sum( c.nbytes for c in self.columns )
+
+    def __len__( self ):
+        return len(self.x)
+
+    def __iter__( self ):
+        return zip( *[c.tolist() for c in self.columns] ).__iter__()
+
+    def __getitem__( self, key ):
+        if isinstance(key, tuple):
+            rows, column= key
+            if isinstance(column, (int, numpy.integer)):
+                return self.columns[column][rows]
+            if column!=slice(None):
+                raise IndexError("only a single column, or all of them, can be selected")
+            key= rows
+        if isinstance(key, (int, numpy.integer)):
+            return tuple( int(c[key]) for c in self.columns )
+        table= SegmentTable( *[c[key] for c in self.columns] )
+        for derived in ("_x2", "_y2", "_area"):
+            if getattr(self, derived) is not None:
+                setattr( table, derived, getattr(self, derived)[key] )
+        return table
+
+    def __array__( self, dtype=None ):
+        rows= numpy.column_stack( self.columns ) if len(self) else numpy.zeros( (0,4), dtype=SEGMENT_COLUMN_DATATYPE )
+        return rows if dtype is None else rows.astype( dtype )
+
+    def __repr__( self ):
+        return "SegmentTable("+repr(numpy.array(self))+")"
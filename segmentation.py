@@ -2,6 +2,8 @@ from opencv_utils import show_image_and_wait_for_key, draw_segments, BlurProcess
 from processor import DisplayingProcessor, DisplayingProcessorStack, create_broadcast
 from segmentation_aux import SegmentOrderer
 from segmentation_filters import create_default_filter_stack, Filter, NearLineFilter
+from image_context import image_context
+from segment_table import SegmentTable
 import numpy
 import cv2
 
@@ -12,8 +14,7 @@ SEGMENTS_DIRECTION= 0 # vertical axis in numpy
 def segments_from_numpy( segments ):
     '''reverses segments_to_numpy'''
     segments= segments if SEGMENTS_DIRECTION==0 else segments.tranpose()
-    segments= [map(int,s) for s in segments]
-    return segments
+    return numpy.array( segments ).tolist() #lists of python ints
 
 def segments_to_numpy( segments ):
     '''given a list of 4-element tuples, transforms it into a numpy array'''
@@ -28,7 +29,7 @@ def region_from_segment( image, segment ):
 
 
 class RawSegmenter( DisplayingProcessor ):
-    '''A image segmenter. input is image, output is segments'''    
+    '''A image segmenter. input is image, output is segments (a SegmentTable)'''    
     def _segment( self, image ):
         '''segments an opencv image for OCR. returns list of 4-element tuples (x,y,width, height).'''
         #return segments
@@ -40,16 +41,19 @@ class RawSegmenter( DisplayingProcessor ):
         return segments
 
 class FullSegmenter( DisplayingProcessorStack ):
-    pass
+    '''A stack of processors that segments a image. Segments are passed
+    between the processors as SegmentTables, but the output is a n*4
+    array, as callers expect'''
+    def _process( self, image ):
+        segments= DisplayingProcessorStack._process( self, image )
+        return numpy.array( segments ) if isinstance(segments, SegmentTable) else segments
 
 class RawContourSegmenter( RawSegmenter ):
     PARAMETERS=  RawSegmenter.PARAMETERS + {"block_size":11, "c":10 }
     def _segment( self, image ):
         self.image= image
-        image= cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
-        image = cv2.adaptiveThreshold(image, maxValue=255, adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C, thresholdType=cv2.THRESH_BINARY, blockSize=self.block_size, C=self.c)
-        contours,hierarchy = cv2.findContours(image,cv2.RETR_LIST,cv2.CHAIN_APPROX_SIMPLE)
-        segments= segments_to_numpy( [cv2.boundingRect(c) for c in contours] )
+        contours,hierarchy = image_context( image ).contours( self.block_size, self.c )
+        segments= SegmentTable.from_rows( [cv2.boundingRect(c) for c in contours] )
         self.contours, self.hierarchy= contours, hierarchy #store, may be needed for debugging
         return segments
     def display(self, display_before=False):
@@ -63,10 +67,110 @@ class RawContourSegmenter( RawSegmenter ):
         draw_segments( copy, self.segments)
         show_image_and_wait_for_key(copy, "image after segmentation by "+self.__class__.__name__)
 
+class TiledContourSegmenter( RawContourSegmenter ):
+    '''RawContourSegmenter on overlapping tiles, segmented by 
+    tile_threads threads (opencv releases the GIL). Each segment is 
+    kept only by the tile whose core (the tile minus the overlap) has 
+    its top left corner, and only if the tile cut doesn't truncate it. 
+    Segments smaller than tile_overlap-block_size/2 are the same as 
+    RawContourSegmenter's (in other order); larger ones may be lost'''
+    PARAMETERS=  RawContourSegmenter.PARAMETERS + {"tile_size":1024, "tile_overlap":64, "tile_threads":4}
+    def _segment_tile( self, gray, core ):
+        '''returns the (image coordinates) segments and contours kept by
+        the tile with the given core (x0,y0,x1,y1)'''
+        h,w= gray.shape
+        cx0,cy0,cx1,cy1= core
+        o= self.tile_overlap
+        x0,y0,x1,y1= max(cx0-o,0), max(cy0-o,0), min(cx1+o,w), min(cy1+o,h)
+        tile= numpy.ascontiguousarray( gray[y0:y1,x0:x1] )
+        tile= cv2.adaptiveThreshold(tile, maxValue=255, adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C, thresholdType=cv2.THRESH_BINARY, blockSize=self.block_size, C=self.c)
+        contours= cv2.findContours(tile,cv2.RETR_LIST,cv2.CHAIN_APPROX_SIMPLE)[-2]
+        segments= numpy.array( [cv2.boundingRect(c) for c in contours], dtype=numpy.int64 ).reshape(-1,4)
+        segments[:,:2]+= (x0,y0)
+        x,y= segments[:,0], segments[:,1]
+        xw,yh= x+segments[:,2], y+segments[:,3]
+        keep= (cx0<=x) & (x<cx1) & (cy0<=y) & (y<cy1)
+        keep&= ((xw<x1) | (x1==w)) & ((yh<y1) | (y1==h)) #not cut by the tile end
+        keep&= ((x>x0) | (x0==0)) & ((y>y0) | (y0==0)) #nor by the tile start
+        contours= [c+(x0,y0) for c,k in zip(contours, keep) if k]
+        return segments[keep], contours
+
+    def _segment( self, image ):
+        self.image= image
+        gray= image_context( image ).gray
+        h,w= gray.shape
+        ts= self.tile_size
+        cores= [(x, y, min(x+ts,w), min(y+ts,h)) for y in range(0,h,ts) for x in range(0,w,ts)]
+        if len(cores)==1 or self.tile_threads<=1:
+            results= [self._segment_tile( gray, core ) for core in cores]
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool= ThreadPool( min(self.tile_threads, len(cores)) )
+            try:
+                results= pool.map( lambda core: self._segment_tile( gray, core ), cores )
+            finally:
+                pool.close()
+                pool.join()
+        segments= numpy.concatenate( [r[0] for r in results] )
+        segments= segments[ numpy.lexsort( segments.T[::-1] ) ] #deterministic order
+        self.contours= sum( [r[1] for r in results], [] )
+        self.hierarchy= None #meaningless across tiles
+        return SegmentTable.from_rows( segments )
+
+class ConnectedComponentsSegmenter( RawSegmenter ):
+    '''segments the (adaptive thresholded) image by labelling its dark
+    connected components, getting all bounding boxes in one opencv call
+    (opencv 3 or newer). The boxes are a pixel larger on each side than
+    the components, like RawContourSegmenter's. The light regions (the
+    background, and holes inside characters), which RawContourSegmenter
+    also returns, are only segmented if suppress_holes is False.
+    The pixel count of each component is stored in self.areas'''
+    PARAMETERS=  RawSegmenter.PARAMETERS + {"block_size":11, "c":10, "connectivity":4, "suppress_holes":True}
+    @staticmethod
+    def _components( binary, connectivity ):
+        '''bounding boxes and areas of the non zero components'''
+        n, labels, stats, centroids= cv2.connectedComponentsWithStats( binary, connectivity=connectivity )
+        return stats[1:,:4], stats[1:,4] #label 0 is the zero pixels
+
+    def _segment( self, image ):
+        if not hasattr( cv2, "connectedComponentsWithStats" ):
+            raise Exception("ConnectedComponentsSegmenter needs opencv 3 or newer")
+        self.image= image
+        binary= image_context( image ).binary( self.block_size, self.c )
+        h,w= binary.shape
+        boxes, areas= self._components( cv2.bitwise_not(binary), self.connectivity )
+        x0, y0= numpy.maximum( boxes[:,0]-1, 0 ), numpy.maximum( boxes[:,1]-1, 0 )
+        x1, y1= numpy.minimum( boxes[:,0]+boxes[:,2]+1, w ), numpy.minimum( boxes[:,1]+boxes[:,3]+1, h )
+        boxes= numpy.column_stack( (x0, y0, x1-x0, y1-y0) )
+        if not self.suppress_holes:
+            light_boxes, light_areas= self._components( binary, 8 )
+            boxes, areas= numpy.concatenate( (boxes, light_boxes) ), numpy.concatenate( (areas, light_areas) )
+        self.areas= areas
+        return SegmentTable.from_rows( boxes )
+
+    def display(self, display_before=False):
+        copy= self.image.copy()
+        if display_before:
+            show_image_and_wait_for_key(copy, "image before segmentation")
+        draw_segments( copy, self.segments)
+        show_image_and_wait_for_key(copy, "image after segmentation by "+self.__class__.__name__)
+
 class ContourSegmenter( FullSegmenter ):
     def __init__(self, **args):
-    	filters = args.get('filters', create_default_filter_stack())
-        stack = [BlurProcessor(), RawContourSegmenter()] + filters + [SegmentOrderer()]
+        self.custom_filters= 'filters' in args
+        self.fused_filters= args.get('fused_filters', False)
+    	filters = args.get('filters', create_default_filter_stack( args.get('fused_filters', False) ))
+        raw_segmenter = args.get('raw_segmenter', RawContourSegmenter())
+        stack = [BlurProcessor(), raw_segmenter] + filters + [SegmentOrderer()]
         FullSegmenter.__init__(self, stack, **args)
         stack[0].add_prehook( create_broadcast( "_input", filters, "image" ) )
 
+    def get_settings( self ):
+        '''the parameters, and the other constructor arguments, for 
+        OCR.save. A custom filter stack can't be saved'''
+        if self.custom_filters:
+            raise Exception("can't describe a ContourSegmenter with a custom filter stack")
+        settings= dict( self.get_parameters() )
+        settings.update( raw_segmenter=self.processors[1], fused_filters=self.fused_filters, memoize=self.memoize, inplace=self.inplace_intermediates )
+        return settings
+
@@ -1,24 +1,32 @@
 from processor import Processor, DisplayingProcessor
 from opencv_utils import draw_lines, show_image_and_wait_for_key
+from segment_table import SegmentTable
 import numpy
 import cv2
 
 class SegmentOrderer( Processor ):
     PARAMETERS= Processor.PARAMETERS + {"max_line_height":20, "max_line_width":10000}
+    def order( self, segments ):
+        '''the indexes that sort segments in read order'''
+        mlh, mlw= self.max_line_height, self.max_line_width
+        s= SegmentTable.wrap( segments )
+        return numpy.argsort( mlw*(s.y.astype( numpy.int64 )//mlh)+s.x ) #int64 prevents overflows
+
     def _process( self, segments ):
         '''sort segments in read order - left to right, up to down'''
         #sort_f= lambda r: max_line_width*(r[1]/max_line_height)+r[0]
         #segments= sorted(segments, key=sort_f)
         #segments= segments_to_numpy( segments )
         #return segments
-        mlh, mlw= self.max_line_height, self.max_line_width
-        s= segments.astype( numpy.uint32 ) #prevent overflows
-        order= mlw*(s[:,1]/mlh)+s[:,0]
-        sort_order= numpy.argsort( order )
-        return segments[ sort_order ]
+        return segments[ self.order( segments ) ]
         
 
 class LineFinder( DisplayingProcessor ):
+    '''finds text lines. line_method can be "kmeans" (tries k-means 
+    with every number of lines up to 50, slow) or "gaps" (one sort; 
+    splits lines where the tops are more than line_gap*median height
+    apart, dropping lines with less than min_line_segments)'''
+    PARAMETERS= DisplayingProcessor.PARAMETERS + {"line_method":"kmeans", "line_gap":0.5, "min_line_segments":1}
     @staticmethod
     def _guess_lines( ys, max_lines=50, confidence_minimum=0.0 ):
         '''guesses and returns text inter-line distance, number of lines, y_position of first line'''
@@ -56,14 +64,46 @@ class LineFinder( DisplayingProcessor ):
         if confidence<confidence_minimum:
             raise Exception("low confidence")
         return lines #still floating points
-        
-    def _process( self, segments ):
-        segment_tops=       segments[:,1]
-        segment_bottoms=    segment_tops+segments[:,3]
+
+    @staticmethod
+    def _guess_lines_by_gaps( ys, min_gap ):
+        '''splits the sorted ys wherever consecutive ones are more than 
+        min_gap apart. returns the line number of each y'''
+        order= numpy.argsort( ys, kind='mergesort' )
+        new_line= numpy.diff( ys[order].astype(numpy.float32) ) > min_gap
+        line_of_y= numpy.empty( len(ys), dtype=numpy.intp )
+        line_of_y[order]= numpy.concatenate( ([0], numpy.cumsum(new_line)) )
+        return line_of_y
+
+    def _kmeans_lines( self, segment_tops, segment_bottoms ):
         tops=               self._guess_lines( segment_tops )
         bottoms=            self._guess_lines( segment_bottoms )
         if len(tops)!=len(bottoms):
             raise Exception("different number of lines")
+        return tops, bottoms
+
+    def _gaps_lines( self, segment_tops, segment_bottoms, segment_heights ):
+        line_of_segment= self._guess_lines_by_gaps( segment_tops, self.line_gap*numpy.median(segment_heights) )
+        counts= numpy.bincount( line_of_segment )
+        good= counts >= self.min_line_segments
+        if not numpy.any(good):
+            raise Exception("no line has at least {0} segments".format(self.min_line_segments))
+        counts= counts[good]
+        tops=    numpy.bincount( line_of_segment, weights=segment_tops    )[good]/counts
+        bottoms= numpy.bincount( line_of_segment, weights=segment_bottoms )[good]/counts
+        #same format as kmeans: a column of float32
+        return tops.astype(numpy.float32).reshape(-1,1), bottoms.astype(numpy.float32).reshape(-1,1)
+        
+    def _process( self, segments ):
+        table=              SegmentTable.wrap( segments )
+        segment_tops=       table.y
+        segment_bottoms=    table.y2
+        if self.line_method=="kmeans":
+            tops, bottoms= self._kmeans_lines( segment_tops, segment_bottoms )
+        elif self.line_method=="gaps":
+            tops, bottoms= self._gaps_lines( segment_tops, segment_bottoms, table.h )
+        else:
+            raise Exception("unknown line_method: "+self.line_method)
         middles=                    (tops+bottoms)/2
         topbottoms=                 numpy.sort( numpy.append( tops, bottoms ) )
         topmiddlebottoms=           numpy.sort( reduce(numpy.append, ( tops, middles, bottoms )) )
@@ -84,9 +124,18 @@ def guess_segments_lines( segments, lines, nearline_tolerance=5.0 ):
     '''given segments, outputs a array of line numbers, or -1 if it 
     doesn't belong to any'''
     ys= segments[:,1]
-    closeness= numpy.abs( numpy.subtract.outer(ys,lines) ) #each row a y, each collumn a distance to each line 
-    line_of_y= numpy.argmin( closeness, axis=1)
-    distance= numpy.min(closeness, axis=1)
+    lines= numpy.ravel( lines )
+    order= numpy.argsort( lines, kind='mergesort' )
+    sorted_lines= lines[order]
+    i= numpy.searchsorted( sorted_lines, ys ) #the nearest line is either the one before or after
+    before= numpy.clip( i-1, 0, len(lines)-1 )
+    before= numpy.searchsorted( sorted_lines, sorted_lines[before] ) #first of repeated lines, like argmin
+    after=  numpy.clip( i,   0, len(lines)-1 )
+    distance_before= numpy.abs( ys-sorted_lines[before] )
+    distance_after=  numpy.abs( ys-sorted_lines[after] )
+    use_after= distance_after < distance_before
+    line_of_y= order[ numpy.where( use_after, after, before ) ]
+    distance=  numpy.where( use_after, distance_after, distance_before )
     bad= distance > numpy.mean(distance)+nearline_tolerance*numpy.std(distance)
     line_of_y[bad]= -1
     return line_of_y
@@ -95,7 +144,9 @@ def guess_segments_lines( segments, lines, nearline_tolerance=5.0 ):
 
 def contained_segments_matrix( segments ):
     '''givens a n*n matrix m, n=len(segments), in which m[i,j] means
-    segments[i] is contained inside segments[j]'''
+    segments[i] is contained inside segments[j].
+    This needs O(n**2) memory; it's kept as the reference 
+    implementation of contained_segments'''
     x1,y1= segments[:,0], segments[:,1]
     x2,y2= x1+segments[:,2], y1+segments[:,3]
     n=len(segments)
@@ -109,3 +160,29 @@ def contained_segments_matrix( segments ):
     a_inside_b_y= o2[y1soi][:,y1soi] * o1[y2soi][:,y2soi] #(y1[a]>y1[b] and y2[a]<y2[b])
     a_inside_b= a_inside_b_x*a_inside_b_y
     return a_inside_b
+
+
+def contained_segments( segments ):
+    '''returns a boolean vector v, n=len(segments), in which v[i] means
+    segments[i] is contained inside some other segment. Equivalent to
+    numpy.max(contained_segments_matrix(segments), axis=1), but uses 
+    O(n) memory and O(n log n + k) time, k being the number of pairs 
+    of segments that overlap on the x axis.
+    Segments are swept by x1; the active segments are the ones already 
+    swept that still reach the sweep line. Ties are broken through the
+    same sort ranks contained_segments_matrix uses, so that the results
+    are exactly the same'''
+    segments= SegmentTable.wrap( segments )
+    x1,y1= segments.x, segments.y
+    x2,y2= segments.x2, segments.y2
+    n=len(segments)
+    
+    x1so, x2so,y1so, y2so= map(numpy.argsort, (x1,x2,y1,y2))
+    x1soi,x2soi, y1soi, y2soi= map(numpy.argsort, (x1so, x2so, y1so, y2so)) #ranks
+    contained= numpy.zeros( n, dtype=bool )
+    active= numpy.zeros( 0, dtype=numpy.intp )
+    for a in x1so:
+        active= active[ x2[active] >= x1[a] ] #these can't contain a, nor any segment swept after it
+        contained[a]= numpy.any( (x2soi[active] > x2soi[a]) & (y1soi[active] < y1soi[a]) & (y2soi[active] > y2soi[a]) )
+        active= numpy.append( active, a )
+    return contained
@@ -1,67 +1,104 @@
-from opencv_utils import show_image_and_wait_for_key, BrightnessProcessor, draw_segments, draw_lines
-from segmentation_aux import contained_segments_matrix, LineFinder, guess_segments_lines
+from opencv_utils import show_image_and_wait_for_key, change_brightness, draw_segments, draw_lines
+from segmentation_aux import contained_segments, LineFinder, guess_segments_lines
 from processor import DisplayingProcessor, create_broadcast
+from segment_table import SegmentTable
 import numpy
 
+class EmptySegmentationError( Exception ):
+    '''raised when filters leave no segments'''
+    pass
 
-def create_default_filter_stack():
-    stack= [LargeFilter(), SmallFilter(), LargeAreaFilter(), ContainedFilter(), LineFinder(), NearLineFilter()]
-    stack[4].add_poshook( create_broadcast( "lines_topmiddlebottoms", stack[5] ) )
-    return stack
+def create_default_filter_stack( fused=False ):
+    '''if fused, consecutive fusable filters are run as a FusedFilter'''
+    line_finder, near_line_filter= LineFinder(), NearLineFilter()
+    line_finder.add_poshook( create_broadcast( "lines_topmiddlebottoms", near_line_filter ) )
+    stack= [LargeFilter(), SmallFilter(), LargeAreaFilter(), ContainedFilter(), line_finder, near_line_filter]
+    return fuse_filters( stack ) if fused else stack
+
+def fuse_filters( filters ):
+    '''replaces each run of consecutive fusable filters with a FusedFilter'''
+    result, run= [], []
+    for f in filters + [None]:
+        if f is not None and getattr(f, "FUSABLE", False):
+            run.append( f )
+            continue
+        if len(run)>1:
+            result.append( FusedFilter(run) )
+        else:
+            result.extend( run )
+        run= []
+        if f is not None:
+            result.append( f )
+    return result
 
 
 class Filter( DisplayingProcessor ):
     PARAMETERS= DisplayingProcessor.PARAMETERS
     '''A filter processes given segments, returning only the desirable
-    ones'''
+    ones. Segments may be a n*4 array or a SegmentTable; the output 
+    is of the same type. Fusable filters decide on each segment 
+    independently of the others, so they can be run by a FusedFilter'''
+    FUSABLE= False
+    _fused_input= None #(segments, mask) when run by a FusedFilter
+    def _filtered_input( self ):
+        '''the segments this filter was given'''
+        if self._fused_input is not None:
+            segments, mask= self._fused_input
+            return segments[mask]
+        return self._input
     def display( self, display_before=False):
         '''shows the effect of this filter'''
         try:
             copy= self.image.copy()
         except AttributeError:
             raise Exception("You need to set the Filter.image attribute for displaying")
-        copy= BrightnessProcessor(brightness=0.6).process( copy )
-        s, g= self._input, self.good_segments_indexes
+        copy= change_brightness( copy, 0.6 )
+        s, g= self._filtered_input(), self.good_segments_indexes
         draw_segments( copy, s[g], (0,255,0) )
-        draw_segments( copy, s[True-g], (0,0,255) )
+        draw_segments( copy, s[numpy.logical_not(g)], (0,0,255) )
         show_image_and_wait_for_key( copy, "segments filtered by "+self.__class__.__name__)
     def _good_segments( self, segments ):
         raise NotImplementedError
     def _process( self, segments):
         good= self._good_segments(segments)
         self.good_segments_indexes= good
+        self._fused_input= None
         segments= segments[good]  
         if not len(segments):
-            raise Exception("0 segments after filter "+self.__class__.__name__)
+            raise EmptySegmentationError("0 segments after filter "+self.__class__.__name__)
         return segments
 
 class LargeFilter( Filter ):
     '''desirable segments are larger than some width or height'''
     PARAMETERS= Filter.PARAMETERS + {"min_width":4, "min_height":8}
+    FUSABLE= True
     def _good_segments( self, segments ):
-        good_width=  segments[:,2] >= self.min_width
-        good_height= segments[:,3] >= self.min_height
+        segments= SegmentTable.wrap( segments )
+        good_width=  segments.w >= self.min_width
+        good_height= segments.h >= self.min_height
         return good_width * good_height  #AND
 
 class SmallFilter( Filter ):
     '''desirable segments are smaller than some width or height'''
     PARAMETERS= Filter.PARAMETERS + {"max_width":30, "max_height":50}
+    FUSABLE= True
     def _good_segments( self, segments ):
-        good_width=  segments[:,2]  <= self.max_width
-        good_height= segments[:,3] <= self.max_height
+        segments= SegmentTable.wrap( segments )
+        good_width=  segments.w <= self.max_width
+        good_height= segments.h <= self.max_height
         return good_width * good_height  #AND
         
 class LargeAreaFilter( Filter ):
     '''desirable segments' area is larger than some'''
     PARAMETERS= Filter.PARAMETERS + {"min_area":45}
+    FUSABLE= True
     def _good_segments( self, segments ):
-        return (segments[:,2]*segments[:,3]) >= self.min_area
+        return SegmentTable.wrap( segments ).area >= self.min_area
 
 class ContainedFilter( Filter ):
     '''desirable segments are not contained by any other'''
     def _good_segments( self, segments ):
-        m= contained_segments_matrix( segments )
-        return (True - numpy.max(m, axis=1))
+        return numpy.logical_not( contained_segments( segments ) )
 
 class NearLineFilter( Filter ):
     PARAMETERS= Filter.PARAMETERS + {"nearline_tolerance":5.0} # percentage distance stddev
@@ -70,3 +107,45 @@ class NearLineFilter( Filter ):
         lines= guess_segments_lines(segments, self.lines_topmiddlebottoms, nearline_tolerance=self.nearline_tolerance)
         good= lines!=-1
         return good
+
+class FusedFilter( Filter ):
+    '''runs several fusable filters as one: each one's mask is computed
+    on all the segments, the masks are combined, and the segments are 
+    selected only once. Each filter's good_segments_indexes is still 
+    relative to the segments it would have been given, for display'''
+    def __init__( self, filters, **args ):
+        assert all( f.FUSABLE for f in filters )
+        self.filters= filters
+        Filter.__init__( self, **args )
+
+    def get_parameters( self ):
+        d= {}
+        for f in self.filters:
+            d.update( f.get_parameters() )
+        return d
+
+    def set_parameters( self, **args ):
+        not_used, not_given= set(), set()
+        for f in self.filters:
+            nu, ng= f.set_parameters( **args )
+            not_used=  not_used.union(nu)
+            not_given= not_given.union(ng)
+        return not_used, not_given
+
+    def _good_segments( self, segments ):
+        segments= SegmentTable.wrap( segments ) #derived columns computed once, for all filters
+        good= numpy.ones( len(segments), dtype=bool )
+        for f in self.filters:
+            mask= f._good_segments( segments )
+            f.good_segments_indexes= mask[good]
+            f._fused_input= (self._input, good.copy())
+            if hasattr( self, "image" ):
+                f.image= self.image
+            good&= mask
+            if not numpy.any(good):
+                raise EmptySegmentationError("0 segments after filter "+f.__class__.__name__)
+        return good
+
+    def display( self, display_before=False ):
+        for f in self.filters:
+            f.display( display_before )
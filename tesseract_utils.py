@@ -1,24 +1,65 @@
 import numpy
+import os
 
 from classification import classes_from_numpy, classes_to_numpy
-from segmentation import segments_from_numpy, segments_to_numpy
+from segmentation import segments_to_numpy
 
+SIDECAR_EXTENSION= ".npz" #binary cache of a box file, next to it
 
-    
-def read_boxfile( path ):
-    classes=  []
-    segments= []
-    with open(path) as f:
-        for line in f:
-            s= line.split(" ")
-            assert len(s)==6
-            assert s[5]=='0\n'
-            classes.append( s[0].decode('utf-8') )
-            segments.append( map(int, s[1:5]))
-    return classes_to_numpy(classes), segments_to_numpy(segments)
+def _box_stat( path ):
+    '''identifies a version of a box file, to validate its sidecar'''
+    st= os.stat( path )
+    return numpy.array( [st.st_mtime, st.st_size], dtype=numpy.float64 )
 
-def write_boxfile(path, classes, segments):
-    classes, segments= classes_from_numpy(classes), segments_from_numpy(segments)
-    with open(path, 'w') as f:
-        for c,s in zip(classes, segments):
-            f.write( c.encode('utf-8')+' '+ ' '.join(map(str, s))+" 0\n")
+def _read_sidecar( path ):
+    '''returns (classes, segments) from the box file sidecar, or None 
+    if it doesn't exist or is out of date'''
+    try:
+        with numpy.load( path+SIDECAR_EXTENSION ) as sidecar:
+            if not numpy.array_equal( sidecar["box_stat"], _box_stat(path) ):
+                return None
+            return sidecar["classes"], sidecar["segments"]
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+def _write_sidecar( path, classes, segments ):
+    '''best effort: the box file directory may not be writable'''
+    try:
+        with open( path+SIDECAR_EXTENSION, 'wb' ) as f:
+            numpy.savez( f, classes=classes, segments=segments, box_stat=_box_stat(path) )
+    except (IOError, OSError):
+        pass
+
+def read_boxfile( path, use_sidecar=True ):
+    '''reads a box file, with one "char x y w h 0" line per segment.
+    If use_sidecar, reads the binary sidecar instead, when it's up to 
+    date, or writes it'''
+    if use_sidecar:
+        cached= _read_sidecar( path )
+        if cached is not None:
+            return cached
+    with open(path, 'rb') as f:
+        tokens= f.read().split()
+    if len(tokens)%6:
+        raise Exception( "malformed box file: "+path )
+    chars= tokens[0::6]
+    del tokens[0::6]
+    numbers= numpy.array( tokens ).astype( numpy.int64 ).reshape( (-1,5) )
+    if numpy.any( numbers[:,4]!=0 ):
+        raise Exception( "malformed box file (last column must be 0): "+path )
+    classes= "".join( chars ).decode('utf-8')
+    if len(classes)!=len(chars):
+        raise Exception( "box file classes must be single chars: "+path )
+    classes, segments= classes_to_numpy(classes), segments_to_numpy(numbers[:,:4])
+    if use_sidecar:
+        _write_sidecar( path, classes, segments )
+    return classes, segments
+
+def write_boxfile(path, classes, segments, use_sidecar=True):
+    segments= segments_to_numpy( segments )
+    lines= zip( classes_from_numpy(classes.reshape(-1).tolist()), segments.tolist() )
+    text= u"".join( u"{0} {1} {2} {3} {4} 0\n".format(c, *s) for c,s in lines )
+    with open(path, 'wb') as f:
+        f.write( text.encode('utf-8') )
+    if use_sidecar:
+        _write_sidecar( path, classes, segments )
@@ -0,0 +1,109 @@
+'''parameter sweeps, to tune the segmenter of a (trained) OCR on grounded files'''
+
+from files import ImageFile
+from ocr import accuracy
+from timeit import default_timer
+import multiprocessing
+import itertools
+
+def parameter_grid( grid ):
+    '''given a dict of parameter names to lists (or other iterables) of
+    values, returns a list with a parameters dict for each combination'''
+    names= sorted( grid.keys() )
+    values= [list(grid[n]) for n in names]
+    return [dict(zip(names, combination)) for combination in itertools.product( *values )]
+
+def _check_parameter_names( ocr, names ):
+    unknown= set(names).difference( ocr.segmenter.get_parameters() )
+    if unknown:
+        raise Exception("unknown segmenter parameters: "+", ".join(sorted(unknown)))
+
+def evaluate( ocr, parameters, image_files, min_accuracy=0.0, min_files=1 ):
+    '''sets parameters on the ocr segmenter and ocrs the (grounded)
+    image files. Pages that fail count as 0 accuracy. If, after
+    min_files, the mean accuracy is below min_accuracy, the remaining
+    files are skipped (the result is "terminated"). Returns a dict with
+    the parameters, mean accuracy, pages per second and number of
+    pages and errors. Unknown parameter names raise'''
+    if not image_files:
+        raise Exception("no image files to evaluate on")
+    _check_parameter_names( ocr, parameters )
+    ocr.segmenter.set_parameters( **parameters )
+    accuracies, errors, elapsed= [], 0, 0.0
+    terminated= False
+    for image_file in image_files:
+        if not image_file.isGrounded():
+            raise Exception("The provided file is not grounded: "+image_file.image_path)
+        image_file.image #decode now, so it's not timed
+        start= default_timer()
+        try:
+            classes, segments= ocr.ocr( image_file )
+            elapsed+= default_timer()-start
+            accuracies.append( accuracy( image_file.ground.classes, classes ) )
+        except Exception: #includes a wrong number of segments
+            elapsed+= default_timer()-start
+            accuracies.append( 0.0 )
+            errors+= 1
+        mean_accuracy= sum(accuracies)/len(accuracies)
+        if len(accuracies)>=min_files and mean_accuracy<min_accuracy and len(accuracies)<len(image_files):
+            terminated= True
+            break
+    return {
+        "parameters":       parameters,
+        "accuracy":         mean_accuracy,
+        "pages_per_second": len(accuracies)/elapsed if elapsed else float("inf"),
+        "pages":            len(accuracies),
+        "errors":           errors,
+        "terminated":       terminated,
+        }
+
+_sweep_state= None #(ocr, image_files, min_accuracy, min_files) of a sweep worker process
+
+def _init_sweep_worker( ocr, image_paths, min_accuracy, min_files ):
+    global _sweep_state
+    _sweep_state= ocr, [ImageFile(p, cached=False) for p in image_paths], min_accuracy, min_files #each keeps its image
+
+def _sweep_worker( parameters ):
+    ocr, image_files, min_accuracy, min_files= _sweep_state
+    return evaluate( ocr, parameters, image_files, min_accuracy, min_files )
+
+def sweep( ocr, grid, image_paths, workers=None, min_accuracy=0.0, min_files=1 ):
+    '''evaluates every combination of the parameter grid (see
+    parameter_grid) on the grounded image paths, using a pool of
+    workers processes (see evaluate). The OCR must be trained; it's
+    sent to each worker once. Returns the list of results, in the
+    order they finished. If workers is 1, everything runs on this
+    process, and the segmenter parameters are restored afterwards'''
+    configurations= parameter_grid( grid ) if isinstance(grid, dict) else list(grid)
+    for parameters in configurations: #before starting any work
+        _check_parameter_names( ocr, parameters )
+    initargs= (ocr, list(image_paths), min_accuracy, min_files)
+    ocr._train_from_store() #once, not on every worker
+    if workers==1:
+        original= ocr.segmenter.get_parameters()
+        try:
+            _init_sweep_worker( *initargs )
+            return map( _sweep_worker, configurations )
+        finally:
+            ocr.segmenter.set_parameters( **original )
+    pool= multiprocessing.Pool( workers, initializer=_init_sweep_worker, initargs=initargs )
+    try:
+        results= list( pool.imap_unordered( _sweep_worker, configurations ) )
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+def pareto_front( results ):
+    '''the results not dominated by any other on both accuracy and
+    pages per second, best accuracy first. Terminated results are
+    ignored'''
+    results= [r for r in results if not r["terminated"]]
+    results= sorted( results, key=lambda r: (-r["accuracy"], -r["pages_per_second"]) )
+    front, best_speed= [], -1.0
+    for r in results: #each one is only dominated by one with more accuracy, that is, before it
+        if r["pages_per_second"] > best_speed:
+            front.append( r )
+            best_speed= r["pages_per_second"]
+    return front